@@ -18,5 +18,6 @@ setuptools.setup(name='weather-tobiasli',
                      "License :: OSI Approved :: MIT License",
                      "Operating System :: OS Independent",
                  ],
-                 install_requires=['tregex-tobiasli', 'lnetatmo', 'pytest', 'numpy', 'cryptography', 'rdp']
+                 install_requires=['tregex-tobiasli', 'lnetatmo', 'requests', 'pytest', 'numpy', 'cryptography', 'rdp'],
+                 extras_require={'orjson': ['orjson']}
                  )
\ No newline at end of file
@@ -20,5 +20,5 @@ setuptools.setup(name='weather-tobiasli',
                      "License :: OSI Approved :: MIT License",
                      "Operating System :: OS Independent",
                  ],
-                 install_requires=['tregex-tobiasli', 'lnetatmo', 'rdp']
+                 install_requires=['tregex-tobiasli', 'lnetatmo', 'requests', 'rdp']
                  )
\ No newline at end of file
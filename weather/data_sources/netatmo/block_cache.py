@@ -0,0 +1,64 @@
+"""A disk cache for historical data blocks from the Netatmo getmeasure api."""
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Union
+
+Number = Union[int, float]
+BodyType = Dict[str, List[Optional[Number]]]
+
+BLOCK_SIZE = 1024  # The maximum number of values Netatmo returns pr call.
+SETTLE_TIME = 2 * 3600  # Seconds before data is considered final, as modules can upload measurements late.
+
+
+class NetatmoBlockCache:
+    def __init__(self, path: str) -> None:
+        """A sqlite cache for the json bodies of getmeasure calls. Historical data never changes, so a full block
+        (BLOCK_SIZE values) that ends more than SETTLE_TIME ago is the same every time it is requested, and only needs
+        to be fetched from the api once.
+
+        Args:
+            path: Path to the sqlite database. Created if it does not exist.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS blocks (key TEXT PRIMARY KEY, body TEXT NOT NULL)')
+
+    @staticmethod
+    def create_key(*, device_id: str, module_id: Optional[str], mtype: str, date_start: Number) -> str:
+        """Create the cache key for a block. A full block holds the first BLOCK_SIZE values from date_start, so the end
+        of the queried period is not part of the key."""
+        return f'{device_id}|{module_id or ""}|{mtype}|{int(date_start)}'
+
+    @staticmethod
+    def is_final(*, body: BodyType, last_time: Number, now: Number) -> bool:
+        """Check if a block is full and old enough to never change."""
+        return len(body) >= BLOCK_SIZE and last_time < now - SETTLE_TIME
+
+    def get(self, key: str, date_end: Optional[Number] = None) -> Optional[BodyType]:
+        """Return the cached body for key, or None if the block is not cached. The key does not hold the end of the
+        queried period, so values after date_end are left out, like the api does for a call ending at date_end."""
+        with self._lock:
+            row = self._connection.execute('SELECT body FROM blocks WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        body = json.loads(row[0])
+        if date_end is not None:
+            body = {timestamp: values for timestamp, values in body.items() if float(timestamp) <= date_end}
+        return body
+
+    def put(self, key: str, body: BodyType) -> None:
+        """Store the body of a block."""
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO blocks (key, body) VALUES (?, ?)', (key, json.dumps(body)))
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
@@ -1,14 +1,33 @@
 """Definitions of what we can expect of information from a Netatmo configuration."""
+import os
+import json
+import time as timing
+import hashlib
+import logging
+import threading
+from collections import Counter
 from weather.utilities import data_class, camel_converter
 from weather.data_sources.netatmo.identifiers import create_ts_query, create_ts_store_id
-from typing import List, Union, Iterable, Dict, Any
+from typing import List, Union, Iterable, Dict, Any, Tuple, Optional, Callable
 from shyft.time_series import time, Calendar, point_interpretation_policy as point_fx, TimeSeries
 import lnetatmo
 from weather.utilities.ascii_clean import create_ascii_str_from_str
 
+try:  # orjson is an optional, faster json parser. The cache format is the same with and without it.
+    import orjson
+except ImportError:
+    orjson = None
+
 TimeType = Union[float, int, time]
 Number = Union[float, int]
 
+_UTC_CALENDAR = Calendar()
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'my_weather')
+DEFAULT_CACHE_TTL = 3600  # Seconds before cached station metadata is considered stale.
+DEFAULT_CACHE_GRACE = 24 * 3600  # Seconds after cache_ttl that stale metadata is used while it is refreshed.
+CACHE_LOCK_TIMEOUT = 60  # Seconds before the lock of a process fetching metadata is considered abandoned.
+
 
 class NetatmoDomainError(Exception):
     pass
@@ -16,14 +35,15 @@ class NetatmoDomainError(Exception):
 
 class Time(time):
     """Time acts exactly the same as shyft.time_series.time, but has a human legible __repr__ in UTC-time."""
+    __slots__ = ()
 
     def __repr__(self) -> str:
-        utc = Calendar()
-        return f'Time({repr(utc.to_string(self))})'
+        return f'Time({_UTC_CALENDAR.to_string(self)!r})'
 
 
 class NetatmoMeasurementType:
     """Class for representing a Netatmo measurement."""
+    __slots__ = ('name', 'unit', 'point_interpretation', 'name_lower')
     name: str
     unit: str
 
@@ -52,22 +72,23 @@ class NetatmoMeasurementType:
 
 class NetatmoMeasurementTypes(data_class.DataClass):
     """Handle a set of NetatmoMeasurements"""
+    _extra_dir = ('get_measurement',)
 
     def __init__(self, measurement_types: Iterable[NetatmoMeasurementType]) -> None:
         super(NetatmoMeasurementTypes, self).__init__()
         self.dict = {meas.name_lower: meas for meas in measurement_types}
-        self.dir = sorted([meas.name_lower for meas in measurement_types] + ['get_measurement'])
+        self._by_name = {meas.name: meas for meas in measurement_types}
 
     def get_measurement(self, name: str) -> NetatmoMeasurementType:
         """Return a NetatmoMeasurement given the measurements full name."""
-        return next(meas for meas in self.dict.values() if meas.name == name)
+        return self._by_name[name]
 
 
 class NetatmoMeasurement:
     """Class defining a specific Netatmo measurement."""
+    __slots__ = ('station', 'module', 'data_type', '_measurement_name', '_ts_id', '_ts_query', '_time_series')
     data_type: NetatmoMeasurementType
     module: 'NetatmoModule'
-    all_measurements: List["NetatmoMeasurement"] = list()  # An index of all instances of NetatmoMeasurement.
 
     def __init__(self, *, station: 'NetatmoStation', data_type: NetatmoMeasurementType,
                  module: 'NetatmoModule' = None) -> None:
@@ -75,12 +96,19 @@ class NetatmoMeasurement:
         self.station = station
         self.module = module
         self.data_type = data_type
-        self.all_measurements.append(self)
+
+        # The identifiers never change after construction, so they are created on first access and then reused:
+        self._measurement_name: str = None
+        self._ts_id: str = None
+        self._ts_query: str = None
+        self._time_series: TimeSeries = None
 
     @property
     def measurement_name(self) -> str:
         """A representation of the name of the measurement."""
-        return f'{self.station.name}\\{self.module.name}\\{self.data_type.name}'
+        if self._measurement_name is None:
+            self._measurement_name = f'{self.station.name}\\{self.module.name}\\{self.data_type.name}'
+        return self._measurement_name
 
     @property
     def module_id(self) -> Union[str, None]:
@@ -90,20 +118,26 @@ class NetatmoMeasurement:
     @property
     def ts_id(self) -> str:
         """Create the proper ts_id for the measurement."""
-        return create_ts_store_id(station_name=self.station.name_clean,
-                                  module_name=self.module.name_clean,
-                                  data_type=self.data_type.name_clean)
+        if self._ts_id is None:
+            self._ts_id = create_ts_store_id(station_name=self.station.name_clean,
+                                             module_name=self.module.name_clean,
+                                             data_type=self.data_type.name_clean)
+        return self._ts_id
 
     @property
     def ts_query(self) -> str:
         """Create the proper ts_query for the measurement."""
-        return create_ts_query(station_name=self.station.name, module_name=self.module.name,
-                               data_type=self.data_type.name)
+        if self._ts_query is None:
+            self._ts_query = create_ts_query(station_name=self.station.name, module_name=self.module.name,
+                                             data_type=self.data_type.name)
+        return self._ts_query
 
     @property
     def time_series(self) -> TimeSeries:
         """Return a TimeSeries representation of measurement."""
-        return TimeSeries(self.ts_id)
+        if self._time_series is None:
+            self._time_series = TimeSeries(self.ts_id)
+        return self._time_series
 
 
 
@@ -122,12 +156,25 @@ _measurements = [
 
 types = NetatmoMeasurementTypes([NetatmoMeasurementType(*item) for item in _measurements])
 
-PROPERTIES_THAT_ARE_DATES = ['last_setup', 'last_message', 'last_seen', 'last_status_store', 'last_upgrade',
-                             'date_setup']
+PROPERTIES_THAT_ARE_DATES = frozenset({'last_setup', 'last_message', 'last_seen', 'last_status_store', 'last_upgrade',
+                                       'date_setup'})
+
+
+class NetatmoMetadata(data_class.DataClass):
+    """DataClass for Netatmo metadata. Properties that are dates are stored as received from the api, and are converted
+    to Time the first time they are read."""
+
+    def __getattr__(self, item: str) -> Any:
+        value = super(NetatmoMetadata, self).__getattr__(item)
+        if item in PROPERTIES_THAT_ARE_DATES and not isinstance(value, Time):
+            value = Time(value)
+            self.dict[item] = value
+        return value
 
 
-class NetatmoModule(data_class.DataClass):
+class NetatmoModule(NetatmoMetadata):
     """Represent all values present in a Netatmo Module"""
+    _extra_dir = ('id', 'name', 'name_clean', 'station', 'measurements', 'get_measurement_by_name')
     id: str
     name: str
     type: str
@@ -143,27 +190,29 @@ class NetatmoModule(data_class.DataClass):
     battery_vp: Number
     battery_percent: Number
     station: "NetatmoStation"
-    measurements: List[NetatmoMeasurement]
 
     def __init__(self, *, station: "NetatmoStation", **kwargs) -> None:
-        for key, value in kwargs.items():
-            if key in PROPERTIES_THAT_ARE_DATES:
-                kwargs[key] = Time(value)
         super(NetatmoModule, self).__init__(**kwargs)
 
         self.station = station
-        self.measurements = [NetatmoMeasurement(station=self.station,
-                                                module=self,
-                                                data_type=types.get_measurement(name)) for name in self.data_type]
+        # Measurements are only built when they are first asked for:
+        self._measurement_names: List[str] = list(self.data_type)
+        self._measurements_by_name: Dict[str, NetatmoMeasurement] = {}
 
-    def get_measurement_by_name(self, *, name: str) -> NetatmoMeasurement:
+    @property
+    def measurements(self) -> List[NetatmoMeasurement]:
+        """All measurements available from the module."""
+        return [self.get_measurement_by_name(name=name) for name in self._measurement_names]
+
+    def get_measurement_by_name(self, *, name: str) -> Union[NetatmoMeasurement, None]:
         """Get a measurement by the name of the measurement."""
-        return next(
-            (measurement
-             for measurement in self.measurements
-             if measurement.data_type.name == name),
-            None
-        )
+        measurement = self._measurements_by_name.get(name)
+        if measurement is None:
+            if name not in self._measurement_names:
+                return None
+            measurement = NetatmoMeasurement(station=self.station, module=self, data_type=types.get_measurement(name))
+            self._measurements_by_name[name] = measurement
+        return measurement
 
     @property
     def id(self) -> str:
@@ -181,10 +230,11 @@ class NetatmoModule(data_class.DataClass):
         return create_ascii_str_from_str(self.name)
 
 
-class NetatmoStation(data_class.DataClass):
+class NetatmoStation(NetatmoMetadata):
     """Represent metadata for a Netatmo Device. A NetatmoDevice has all the same properties as a module, but has
     some additional properties as well. It has measurements and metadata like a Module, so we subclass it from
     NetatmoModule."""
+    _extra_dir = ('id', 'name', 'name_clean', 'get_module_by_name')
     id: str
     name: str
     last_status_store: Time
@@ -202,26 +252,20 @@ class NetatmoStation(data_class.DataClass):
         contains all the information we would expect of a module. To create a more consistent structure we remove these
         properties and add them as a separate module"""
         modules = kwargs.pop('modules')
-        device_module = dict()
-        for key in modules[0].keys():
-            if key in kwargs:
-                device_module[key] = kwargs.pop(key)
+        device_module = {key: kwargs.pop(key) for key in modules[0] if key in kwargs}
 
         device_module['last_seen'] = kwargs['last_status_store']
         kwargs['_id'] = device_module['_id']  # Need to keep _id property.
-        kwargs['modules'] = [NetatmoModule(**module, station=self) for module in [device_module] + modules]
-        for key, value in kwargs.items():
-            if key in PROPERTIES_THAT_ARE_DATES:
-                kwargs[key] = Time(value)
+        station_modules = [NetatmoModule(**device_module, station=self)]
+        station_modules.extend(NetatmoModule(**module, station=self) for module in modules)
+        kwargs['modules'] = station_modules
         super(NetatmoStation, self).__init__(**kwargs)
+        # Reversed, so that the first module wins if two modules share a name:
+        self._modules_by_name = {module.name: module for module in reversed(self.modules)}
 
     def get_module_by_name(self, *, name: str) -> Union[NetatmoModule, None]:
         """Get a NetatmoDevice object by referencing he name of the device."""
-        return next(
-            (module
-             for module in self.modules
-             if module.name == name),
-            None)
+        return self._modules_by_name.get(name)
 
     @property
     def id(self) -> str:
@@ -248,10 +292,18 @@ class NetatmoDomain:
                  username: str = None,
                  password: str = None,
                  client_id: str = None,
-                 client_secret: str = None) -> None:
+                 client_secret: str = None,
+                 cache_directory: Optional[str] = DEFAULT_CACHE_DIRECTORY,
+                 cache_ttl: float = DEFAULT_CACHE_TTL,
+                 cache_grace: float = DEFAULT_CACHE_GRACE) -> None:
         """Represent the metadata for all devices, modules and measurements in a Netatmo Login. Can accept either the
         actual metadata (device_metadata) or the login information for an account so the information is fetched from
-        the Netatmo Api."""
+        the Netatmo Api.
+
+        Metadata fetched from the Netatmo Api is cached in cache_directory. A cache younger than cache_ttl seconds is
+        used directly. A stale cache within cache_grace seconds after that is used while it is refreshed in the
+        background. An older cache is only used if the Netatmo Api can not be reached. Set cache_directory to None to
+        always fetch from the Netatmo Api."""
         if not (device_metadata or (username and password and client_id and client_secret)):
             raise NetatmoDomainError(f'{NetatmoDomain.__name__} needs either device_metadata directly or complete'
                                      f'login information.')
@@ -259,14 +311,13 @@ class NetatmoDomain:
         if device_metadata:
             metadata = device_metadata
         else:
-            auth = lnetatmo.ClientAuth(clientId=client_id,
-                                       clientSecret=client_secret,
-                                       username=username,
-                                       password=password,
-                                       scope='read_station')
-            device_data = lnetatmo.WeatherStationData(auth)
-
-            metadata = device_data.stations
+            metadata = _get_station_metadata(username=username,
+                                             password=password,
+                                             client_id=client_id,
+                                             client_secret=client_secret,
+                                             cache_directory=cache_directory,
+                                             cache_ttl=cache_ttl,
+                                             cache_grace=cache_grace)
 
         self.metadata: Dict[str, Any] = metadata
 
@@ -274,16 +325,180 @@ class NetatmoDomain:
             NetatmoStation(**station) for station in metadata.values()
         ]
 
+        self._stations_by_name: Dict[str, NetatmoStation] = {station.name: station for station in self.stations}
+        if len(self._stations_by_name) != len(self.stations):
+            counts = Counter(station.name for station in self.stations)
+            duplicates = sorted(name for name, count in counts.items() if count > 1)
+            raise NetatmoDomainError(f'{NetatmoDomain.__name__} found several stations with the same name: '
+                                     f'{", ".join(duplicates)}')
+
+        # Filled by get_measurement, so measurements are still only built when they are first asked for:
+        self._measurement_index: Dict[Tuple[str, str, str], NetatmoMeasurement] = {}
+
     def get_station_by_name(self, *, name: str) -> Union[NetatmoStation, None]:
         """Get a NetatmoDevice object by referencing the name of the device."""
-        return next((stat for stat in self.stations if stat.name == name), None)
+        return self._stations_by_name.get(name)
 
     def get_measurement(self, *, station_name: str, module_name: str, data_type: Union[str, NetatmoMeasurementType]
                         ) -> NetatmoMeasurement:
         """Given a device (station), a module and a data type, return the corresponding measurement from the domain:"""
-        if isinstance(data_type, str):
-            data_type = types.get_measurement(data_type)
-
-        dev = self.get_station_by_name(name=station_name)
-        module = dev.get_module_by_name(name=module_name)
-        return module.get_measurement_by_name(name=data_type.name)
+        key = (station_name, module_name, data_type if isinstance(data_type, str) else data_type.name)
+        measurement = self._measurement_index.get(key)
+        if measurement is None:
+            dev = self.get_station_by_name(name=station_name)
+            module = dev.get_module_by_name(name=module_name)
+            try:
+                data_type_name = types.get_measurement(key[2]).name  # Validates the name.
+            except KeyError:
+                raise NetatmoDomainError(f'{key[2]} is not a known Netatmo data type: '
+                                         f'{", ".join(meas.name for meas in types.dict.values())}') from None
+            measurement = module.get_measurement_by_name(name=data_type_name)
+            if measurement is not None:
+                self._measurement_index[key] = measurement
+        return measurement
+
+
+def _fetch_station_metadata(*, username: str, password: str, client_id: str, client_secret: str) -> Dict[str, Any]:
+    """Fetch the metadata for all stations in a Netatmo login from the Netatmo Api."""
+    auth = lnetatmo.ClientAuth(clientId=client_id,
+                               clientSecret=client_secret,
+                               username=username,
+                               password=password,
+                               scope='read_station')
+    return lnetatmo.WeatherStationData(auth).stations
+
+
+def metadata_cache_path(*, cache_directory: str, client_id: str) -> str:
+    """Return the path of the metadata cache for a client_id. The client_id is hashed, so it is not stored in clear
+    text on disk."""
+    key = hashlib.sha256(client_id.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_directory, f'netatmo_stations_{key}.json')
+
+
+def _read_metadata_cache(path: str) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Return the cached metadata and its age in seconds, or (None, inf) if there is no usable cache."""
+    try:
+        age = timing.time() - os.path.getmtime(path)
+        with open(path, 'rb') as cache_file:
+            content = cache_file.read()
+        return (orjson.loads(content) if orjson else json.loads(content.decode('utf-8'))), age
+    except (OSError, ValueError):
+        return None, float('inf')
+
+
+def _write_metadata_cache(path: str, metadata: Dict[str, Any]) -> None:
+    """Write metadata to the cache. The file is replaced atomically, so readers never see a partial cache."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(orjson.dumps(metadata) if orjson else json.dumps(metadata).encode('utf-8'))
+        os.replace(temp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f'Could not write Netatmo metadata cache {path}: {e}')
+
+
+def _lock_metadata_cache(path: str) -> bool:
+    """Try to take the lock on a metadata cache, so only one process at a time fetches metadata for it. Returns True if
+    the lock was taken. A lock older than CACHE_LOCK_TIMEOUT is left from a crashed process, and is taken over."""
+    lock_path = path + '.lock'
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        for _ in range(2):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                if timing.time() - os.path.getmtime(lock_path) < CACHE_LOCK_TIMEOUT:
+                    return False
+                os.remove(lock_path)
+    except OSError as e:
+        logging.warning(f'Could not lock Netatmo metadata cache {path}: {e}')
+    return False
+
+
+def _unlock_metadata_cache(path: str) -> None:
+    """Release the lock taken by _lock_metadata_cache."""
+    try:
+        os.remove(path + '.lock')
+    except OSError:
+        pass
+
+
+def _refresh_metadata_cache(path: str, fetch: Callable[[], Dict[str, Any]]) -> None:
+    """Fetch metadata from the Netatmo Api and store it in the cache. Used as a background refresh, so errors are only
+    logged, and the refresh is skipped if another process is already refreshing the cache."""
+    if not _lock_metadata_cache(path):
+        return
+    try:
+        _write_metadata_cache(path, fetch())
+    except Exception as e:
+        logging.warning(f'Background refresh of Netatmo metadata cache failed: {e}')
+    finally:
+        _unlock_metadata_cache(path)
+
+
+def get_cached_station_metadata(*, fetch: Callable[[], Dict[str, Any]], cache_path: str, cache_ttl: float,
+                                cache_grace: float = DEFAULT_CACHE_GRACE) -> Dict[str, Any]:
+    """Get station metadata through the metadata cache at cache_path (stale-while-revalidate).
+
+    A cache younger than cache_ttl seconds is returned directly, without calling fetch. A stale cache that is less than
+    cache_grace seconds past cache_ttl is returned directly too, and refreshed in the background. Otherwise the
+    metadata is fetched and cached, with a lock so parallel processes do not all fetch the same metadata. If the fetch
+    fails, an expired cache is used.
+
+    Args:
+        fetch: Function fetching the metadata from the Netatmo Api.
+        cache_path: Path to the cache file.
+        cache_ttl: Seconds before the cached metadata is considered stale.
+        cache_grace: Seconds after cache_ttl that stale metadata is used while it is refreshed in the background.
+
+    Returns:
+        The metadata for all stations in a Netatmo login.
+    """
+    cached, age = _read_metadata_cache(cache_path)
+    if cached is not None and age <= cache_ttl:
+        return cached
+    if cached is not None and age <= cache_ttl + cache_grace:
+        threading.Thread(target=_refresh_metadata_cache, args=(cache_path, fetch), daemon=True).start()
+        return cached
+
+    locked = _lock_metadata_cache(cache_path)
+    if not locked:
+        # Another process is fetching the metadata. Wait for it to finish rather than fetching the same data:
+        deadline = timing.time() + CACHE_LOCK_TIMEOUT
+        while timing.time() < deadline and os.path.exists(cache_path + '.lock'):
+            timing.sleep(0.1)
+        cached, age = _read_metadata_cache(cache_path)
+        if cached is not None and age <= cache_ttl:
+            return cached
+
+    try:
+        metadata = fetch()
+    except Exception as e:
+        if cached is None:
+            raise NetatmoDomainError(f'Could not get Netatmo metadata from the Netatmo Api, and there is no cached '
+                                     f'metadata: {e}') from e
+        logging.warning(f'Could not get Netatmo metadata from the Netatmo Api, using cached metadata that is '
+                        f'{age:.0f} seconds old: {e}')
+        return cached
+    else:
+        _write_metadata_cache(cache_path, metadata)
+        return metadata
+    finally:
+        if locked:
+            _unlock_metadata_cache(cache_path)
+
+
+def _get_station_metadata(*, username: str, password: str, client_id: str, client_secret: str,
+                          cache_directory: Optional[str], cache_ttl: float, cache_grace: float) -> Dict[str, Any]:
+    """Get the metadata for all stations in a Netatmo login, using the metadata cache when possible."""
+    login = dict(username=username, password=password, client_id=client_id, client_secret=client_secret)
+    if cache_directory is None:
+        return _fetch_station_metadata(**login)
+
+    return get_cached_station_metadata(fetch=lambda: _fetch_station_metadata(**login),
+                                       cache_path=metadata_cache_path(cache_directory=cache_directory,
+                                                                      client_id=client_id),
+                                       cache_ttl=cache_ttl,
+                                       cache_grace=cache_grace)
@@ -1,13 +1,15 @@
 """Methods used for building and parsing urls used for read and find callbacks."""
-from typing import List, Dict, Tuple
-import urllib
-import tregex
+from functools import lru_cache
+from operator import attrgetter
+from typing import List, Dict, Tuple, Iterable
+import urllib.parse
 import shyft.time_series as st
 
 REPO_IDENTIFIER = 'netatmo'
 PARAMETERS = {'station_name', 'module_name', 'data_type'}
 
-query_pattern = tregex.TregexCompiled(r'(\w+)=(.*?)(?:&|$)')
+# Gets the (station_name, module_name, data_type) of a NetatmoMeasurement used in create_ts_id:
+_ts_id_parts = attrgetter('station.station_name', 'module.name', 'data_type.name')
 
 
 class NetatmoUrlParseError(Exception):
@@ -22,6 +24,12 @@ def create_ts_store(measurement: "NetatmoMeasurement") -> st.TimeSeries:
                                             data_type=measurement.data_type.name))
 
 
+def create_ts_netatmo_batch(measurements: Iterable["NetatmoMeasurement"]) -> List[st.TimeSeries]:
+    """From many NetatmoMeasurements, create a list of st.TimeSeries referencing Netatmo API data. Equivalent to calling
+    create_ts_netatmo for each measurement, but without the per-call keyword handling."""
+    return [st.TimeSeries(_build_ts_id(*_ts_id_parts(measurement))) for measurement in measurements]
+
+
 def create_ts_netatmo(measurement: "NetatmoMeasurement") -> st.TimeSeries:
     """From a NetatmoMeasurement, create a st.TimeSeries referencing Netatmo API data."""
     return st.TimeSeries(create_ts_id(station_name=measurement.station.station_name,
@@ -32,15 +40,28 @@ def create_ts_netatmo(measurement: "NetatmoMeasurement") -> st.TimeSeries:
 def create_ts_store_id(*, station_name: str, data_type: str, module_name: str = '') -> str:
     """Create a valid ts url from a netatmo station_name, module_name and data_type to identify a timeseries in the store
     of a DtssHost. If measurement resides in a NetatmoDevice, module can be left blank."""
-    if module_name:
-        module_name = module_name + '/'
-    return f'shyft://{REPO_IDENTIFIER}/{station_name}/{module_name}{data_type}'
+    return _build_ts_store_id(station_name, module_name, data_type)
+
+
+@lru_cache(maxsize=4096)
+def _build_ts_store_id(station_name: str, module_name: str, data_type: str) -> str:
+    """Cached, positional implementation of create_ts_store_id."""
+    return f'shyft://{REPO_IDENTIFIER}/{station_name}/{module_name + "/" if module_name else ""}{data_type}'
 
 
 def create_ts_id(*, station_name: str, data_type: str, module_name: str = '') -> str:
     """Create a valid ts url from a netatmo station_name, module_name and data_type to identify a timeseries. If
     measurement resides in a NetatmoDevice, module can be left blank."""
-    return f'{REPO_IDENTIFIER}://?station_name={station_name}&module_name={module_name}&data_type={data_type}'
+    return _build_ts_id(station_name, module_name, data_type)
+
+
+@lru_cache(maxsize=4096)
+def _build_ts_id(station_name: str, module_name: str, data_type: str) -> str:
+    """Cached, positional implementation of create_ts_id. The values are quoted, so names containing characters like
+    '+', '%' or '&' survive parse_ts_id."""
+    quote = urllib.parse.quote
+    return (f'{REPO_IDENTIFIER}://?station_name={quote(station_name, safe="")}'
+            f'&module_name={quote(module_name, safe="")}&data_type={quote(data_type, safe="")}')
 
 
 def parse_ts_id(*, ts_id: str) -> Dict[str, str]:
@@ -50,8 +71,8 @@ def parse_ts_id(*, ts_id: str) -> Dict[str, str]:
         raise NetatmoUrlParseError(f'ts_id scheme does not match repository name: '
                                    f'ts_id={parse.scheme}, repo={REPO_IDENTIFIER}')
 
-    match: List[Tuple[str, str]] = query_pattern.to_tuple(parse.query)
-    if not all(m[0] in PARAMETERS for m in match):
+    match: List[Tuple[str, str]] = urllib.parse.parse_qsl(parse.query, keep_blank_values=True)
+    if not all(key in PARAMETERS for key, _ in match):
         raise NetatmoUrlParseError(f'ts_id url does not contain the correct parameters: {PARAMETERS}')
     return dict(match)
 
@@ -1,27 +1,48 @@
 """This module contains NetatmoRepository which contains all necessary methods for a DtssHost to handle communications
 with a Netatmo weather station service."""
 
+import os
+import json
+import threading
 import typing as ty
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from itertools import chain
+from time import sleep, monotonic
 import logging
 
 import numpy as np
 import lnetatmo
+import requests
+from requests.adapters import HTTPAdapter
 from shyft.time_series import (StringVector, UtcPeriod, TimeAxisByPoints, TimeSeries, POINT_INSTANT_VALUE, TsVector,
                                TsInfoVector,
-                               TsInfo, time, utctime_now, Calendar)
+                               TsInfo, time, utctime_now, Calendar, DoubleVector)
 
 from weather.data_sources.netatmo.domain import NetatmoDomain
 from weather.interfaces.config import RepositoryConfigBase, EnvVarConfig, EncryptedEnvVarConfig
 from weather.interfaces.data_collection_repository import DataCollectionRepository
 from weather.data_sources.netatmo.identifiers import parse_ts_id, parse_ts_query
-from weather.utilities import rate_limiter
+from weather.data_sources.netatmo.block_cache import NetatmoBlockCache
+from weather.data_sources.netatmo.domain import (DEFAULT_CACHE_DIRECTORY, get_cached_station_metadata,
+                                                  metadata_cache_path)
+from weather.utilities.adaptive_token_bucket import AdaptiveTokenBucket
+from weather.utilities.aimd_concurrency_limiter import AimdConcurrencyLimiter
+
+try:  # orjson is an optional, faster json parser for the getmeasure responses.
+    import orjson
+except ImportError:
+    orjson = None
 
 DeviceMetadataType = ty.Dict[str, object]
 TimeType = ty.Union[float, int, time]
 Number = ty.Union[float, int]
-NoneType = type(None)
-NanType = type(np.nan)
+
+GETMEASURE_URL = 'https://api.netatmo.com/api/getmeasure'
+DEFAULT_BLOCK_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIRECTORY, 'netatmo_blocks.sqlite')
+DEFAULT_TIME_STEP = 300.0  # Netatmo modules measure every five minutes.
+RATE_LIMIT_RESERVE = 0.1  # Spread out the remaining calls when less than this fraction of the api quota is left.
 
 
 class NetatmoRepositoryError(Exception):
@@ -29,66 +50,399 @@ class NetatmoRepositoryError(Exception):
     pass
 
 
+class NetatmoApiError(NetatmoRepositoryError):
+    """Http errors returned by the Netatmo api."""
+
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_throttling_status(status_code: int) -> bool:
+    """Check if a http status code means that the api is throttling us or is overloaded, so the call can be retried
+    after backing off."""
+    return status_code == 429 or status_code >= 500
+
+
+def parse_retry_after(value: str, *, now: float) -> ty.Optional[float]:
+    """Return the timestamp given by a Retry-After header, which is either a number of seconds or a http date."""
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class CachedWeatherStationData(lnetatmo.WeatherStationData):
+    """A WeatherStationData created from station metadata we already have. WeatherStationData.__init__ fetches the
+    metadata from the api, so it is not called. Holds the access token and stations, which is what the
+    NetatmoRepository needs."""
+
+    # noinspection PyMissingConstructor
+    def __init__(self, auth: lnetatmo.ClientAuth, stations: ty.Dict[str, ty.Any]) -> None:
+        self.getAuthToken = auth.accessToken
+        self.stations = stations
+
+
 class NetatmoRepository(DataCollectionRepository):
     """The NetatmoRepository contains methods complying to the the DataCollectionRepository standard."""
     name = 'netatmo'
+    max_attempts = 5  # Number of times a getMeasure call is tried before giving up.
+    station_cache_ttl = 24 * 3600  # Seconds before cached station metadata is refreshed.
+    find_cache_ttl = 5  # Station metadata changes far slower than monitoring repeats the same find queries.
 
     def __init__(self, username: str,
                  password: str,
                  client_id: str,
                  client_secret: str,
-                 rate_limiters: ty.Dict[str, ty.Dict[str, int]] = None) -> None:
+                 rate_limiters: ty.Dict[str, ty.Dict[str, int]] = None,
+                 block_cache_path: ty.Optional[str] = DEFAULT_BLOCK_CACHE_PATH,
+                 station_cache_directory: ty.Optional[str] = DEFAULT_CACHE_DIRECTORY) -> None:
         """
 
         :param username: Netatmo login username.
         :param password: Netatmo login password.
         :param client_id: Client id for communicating with the netatmo api.
         :param client_secret: Client id for communicating with the netatmo api.
-        :param rate_limiters: Parameters for the RateLimiters that make sure we do not trip api communication limits.
-        :param direct_login: Bool dictating if the api connection is established on init or if we want to initiate
-        the api connection later.
+        :param rate_limiters: Api limits (action_limit calls pr timespan seconds) that we must not trip when
+                              communicating with the netatmo api. No limits are applied if None.
+        :param block_cache_path: Path to a sqlite file caching historical data blocks, so they are only fetched from
+                                 the netatmo api once. The file is opened on the first block fetch. The cache is
+                                 disabled if None.
+        :param station_cache_directory: Directory for caching the station metadata, so it is not fetched from the
+                                        netatmo api on every login. The cache is disabled if None.
         """
 
         self.username = username
         self.password = password
         self.client_id = client_id
         self.client_secret = client_secret
+        self.station_cache_directory = station_cache_directory
+
+        # We don't want to breach the Netatmo API rate limiting policy, so calls to the Netatmo servers are paced by a
+        # token bucket that stays within all the limits, and slows down further if the api starts throttling us:
+        self.bucket: ty.Optional[AdaptiveTokenBucket] = (
+            AdaptiveTokenBucket.from_rate_limits(rate_limiters.values()) if rate_limiters else None)
 
-        # We don't want to breach the Netatmo API rate limiting policy, so we apply rate limiters to the functions
-        # performing API calls to the Netatmo servers:
-        self.rate_limiters = [rate_limiter.RateLimiter(**api_limit) for api_limit in rate_limiters.values()]
-        for limiter in self.rate_limiters:
-            self._get_measurements_block = limiter.rate_limit_decorator(self._get_measurements_block)
+        # The number of api calls in flight adapts to the latency and errors of the api (AIMD). The rate limits above
+        # still apply to every call:
+        self.concurrency = AimdConcurrencyLimiter()
+
+        # The block cache is opened on first use, so repositories that never fetch data never touch the disk:
+        self.block_cache_path = block_cache_path
+        self._block_cache: ty.Optional[NetatmoBlockCache] = None
+        self._block_cache_lock = threading.Lock()
+
+        # Data is fetched through one http session, so connections to the Netatmo api are reused between calls:
+        self.session = self.create_session()
 
         # noinspection PyArgumentList
         self.utc = Calendar()
 
+        # The api connection is established on first use (see ensure_login), so processes that never query Netatmo
+        # never pay for the login and the station metadata fetch.
+        self.auth: lnetatmo.ClientAuth = None
+        self.device_data: lnetatmo.WeatherStationData = None
+        self.domain: NetatmoDomain = None
+        self._login_lock = threading.Lock()  # Read callbacks run in parallel, but only one of them logs in.
+
+        # Netatmo modules sample at a fixed interval, so the most common time step is only derived once per module:
+        self._dt_mode_cache: ty.Dict[ty.Tuple[str, str], float] = {}
+
+        # What the api has told us about our quota in the rate limit headers of its responses:
+        self._retry_at: ty.Optional[float] = None
+        self._quota: ty.Optional[ty.Tuple[int, int, float]] = None  # Remaining calls, call limit, reset timestamp.
+
+    @property
+    def block_cache(self) -> ty.Optional[NetatmoBlockCache]:
+        """The cache of historical data blocks, opened on first use. None if the cache is disabled."""
+        if self._block_cache is None and self.block_cache_path:
+            with self._block_cache_lock:
+                if self._block_cache is None:
+                    self._block_cache = NetatmoBlockCache(self.block_cache_path)
+        return self._block_cache
+
+    @staticmethod
+    def create_session() -> requests.Session:
+        """Create a http session that keeps a pool of connections to the Netatmo api alive between calls."""
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0))
+        session.headers.update({'Connection': 'keep-alive'})
+        return session
+
+    def get_measure(self, *,
+                    device_data: lnetatmo.WeatherStationData,
+                    device_id: str,
+                    module_id: ty.Optional[str],
+                    scale: str,
+                    mtype: str,
+                    date_begin: ty.Optional[TimeType] = None,
+                    date_end: ty.Optional[TimeType] = None
+                    ) -> ty.Dict[str, ty.Any]:
+        """Call the Netatmo getmeasure api in the same way as lnetatmo.WeatherStationData.getMeasure, but through the
+        pooled http session of the repository.
+
+        Args:
+            device_data: The netatmo connection, holding the access token.
+            device_id: Unique identifier for the netatmo device.
+            module_id: Unique identifier for the netatmo module (can be None, '').
+            scale: The resolution of the data, like 'max'.
+            mtype: Comma separated measurement types.
+            date_begin: Start of the period we want data for.
+            date_end: End of the period we want data for.
+
+        Returns:
+            The decoded json response.
+
+        Raises:
+            NetatmoApiError: If the api responded with an http error. The status code is kept on the error.
+        """
+        params = {'device_id': device_id, 'scale': scale, 'type': mtype, 'optimize': 'false', 'real_time': 'false'}
+        if module_id:
+            params['module_id'] = module_id
+        if date_begin:
+            params['date_begin'] = date_begin
+        if date_end:
+            params['date_end'] = date_end
+
+        response = self.session.post(GETMEASURE_URL,
+                                     data=params,
+                                     headers={'Authorization': f'Bearer {device_data.getAuthToken}'},
+                                     timeout=10)
+        self._observe_rate_limit_headers(response.headers)
+        if not response.ok:
+            raise NetatmoApiError(f'Netatmo getmeasure failed: code={response.status_code}, reason={response.reason}, '
+                                  f'body={response.text}', status_code=response.status_code)
+        return orjson.loads(response.content) if orjson else json.loads(response.content.decode('utf-8'))
+
     def create_netatmo_connection(self) -> ty.Tuple[lnetatmo.WeatherStationData, NetatmoDomain]:
         """Refresh the netatmo connection."""
-        auth = lnetatmo.ClientAuth(clientId=self.client_id,
-                                   clientSecret=self.client_secret,
-                                   username=self.username,
-                                   password=self.password,
-                                   scope='read_station')
-        device_data = lnetatmo.WeatherStationData(auth)
+        self.auth = lnetatmo.ClientAuth(clientId=self.client_id,
+                                        clientSecret=self.client_secret,
+                                        username=self.username,
+                                        password=self.password,
+                                        scope='read_station')
+        if self.station_cache_directory is None:
+            device_data = lnetatmo.WeatherStationData(self.auth)
+        else:
+            auth = self.auth
+            stations = get_cached_station_metadata(
+                fetch=lambda: lnetatmo.WeatherStationData(auth).stations,
+                cache_path=metadata_cache_path(cache_directory=self.station_cache_directory,
+                                               client_id=self.client_id),
+                cache_ttl=self.station_cache_ttl)
+            device_data = CachedWeatherStationData(self.auth, stations)
         domain = NetatmoDomain(device_data.stations)
 
         return device_data, domain
 
+    def ensure_login(self, rejected: ty.Optional[lnetatmo.WeatherStationData] = None
+                     ) -> ty.Tuple[lnetatmo.WeatherStationData, NetatmoDomain]:
+        """Return the netatmo connection, logging in on first use. The connection is reused until the access token
+        held by WeatherStationData expires, or until the api rejects it.
+
+        Args:
+            rejected: A connection whose access token the api rejected. We log in again if it is still the current one.
+        """
+        connection = self._current_connection(rejected)
+        if connection is None:
+            with self._login_lock:
+                # Another thread may have logged in while we waited for the lock:
+                connection = self._current_connection(rejected)
+                if connection is None:
+                    connection = self.create_netatmo_connection()
+                    self.device_data, self.domain = connection
+        return connection
+
+    def _current_connection(self, rejected: ty.Optional[lnetatmo.WeatherStationData]
+                            ) -> ty.Optional[ty.Tuple[lnetatmo.WeatherStationData, NetatmoDomain]]:
+        """Return the current netatmo connection, or None if we need to log in."""
+        device_data, domain, auth = self.device_data, self.domain, self.auth
+        if device_data is None or device_data is rejected or auth.expiration <= float(utctime_now()):
+            return None
+        return device_data, domain
+
+    def _observe_rate_limit_headers(self, headers: ty.Mapping[str, str]) -> None:
+        """Keep track of the Retry-After and X-RateLimit-* headers of an api response, so the next calls can wait
+        according to what the api says about our quota."""
+        now = float(utctime_now())
+        if 'Retry-After' in headers:
+            self._retry_at = parse_retry_after(headers['Retry-After'], now=now)
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            limit = int(headers['X-RateLimit-Limit'])
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            self._quota = None
+            return
+        # The reset is given either as a timestamp, or as seconds until the reset:
+        self._quota = (remaining, limit, reset if reset > 1e9 else now + reset)
+
+    def server_wait_time(self, now: float) -> float:
+        """Return the number of seconds the api has asked us to wait before the next call, either explicitly through
+        Retry-After, or implicitly by our quota running low."""
+        wait_time = self._retry_at - now if self._retry_at else 0
+        if self._quota:
+            remaining, limit, reset_at = self._quota
+            if remaining < RATE_LIMIT_RESERVE * limit:
+                wait_time = max(wait_time, (reset_at - now) / max(remaining, 1))
+        return max(wait_time, 0)
+
     def wait_for_rate_limiters(self) -> None:
-        """Check with the rate limiters, and wait if needed."""
-        for limiter in self.rate_limiters:
-            limiter.check_next_and_wait()
+        """Wait if the api has asked us to, and take a token from the rate limiting bucket."""
+        wait_time = self.server_wait_time(float(utctime_now()))
+        if wait_time > 0:
+            logging.info(f'{NetatmoRepository.__name__}: asleep for {wait_time:.1f}s as requested by the netatmo api.')
+            sleep(wait_time)
+        if self.bucket:
+            self.bucket.acquire()
+
+    def _fetch_block_body(self, *,
+                          device_data: lnetatmo.WeatherStationData,
+                          device_id: str,
+                          module_id: str,
+                          mtype: str,
+                          date_start: ty.Optional[int],
+                          date_end: ty.Optional[int]
+                          ) -> ty.Dict[str, ty.List[ty.Optional[Number]]]:
+        """Fetch one block of data from the Netatmo api, within the rate limits. Calls the api throttles (429) or fails
+        to serve (5xx) are retried up to max_attempts times with back off. A rejected access token (403) gives a new
+        login before the retry. Other client errors are raised at once.
+
+        Returns:
+            The body of the getmeasure response: values pr measurement type, keyed by timestamp.
+        """
+        for _ in range(self.max_attempts):
+            self.wait_for_rate_limiters()
+            self.concurrency.acquire()
+            start = monotonic()
+            try:
+                data = self.get_measure(
+                    device_data=device_data,
+                    device_id=device_id,
+                    module_id=module_id,
+                    scale='max',
+                    mtype=mtype,
+                    date_begin=date_start,
+                    date_end=date_end)
+            except NetatmoApiError as e:
+                error = e
+                self.concurrency.release(latency=monotonic() - start, throttled=is_throttling_status(e.status_code))
+            except Exception:
+                self.concurrency.release(latency=monotonic() - start, throttled=True)
+                raise
+            else:
+                self.concurrency.release(latency=monotonic() - start)
+                break
+
+            if error.status_code == 403:
+                logging.warning(f'{error} Logging in to the Netatmo api again.')
+                device_data = self.ensure_login(rejected=device_data)[0]
+            elif is_throttling_status(error.status_code):
+                logging.warning(f'{error} Backing off before the next attempt.')
+                if self.bucket:
+                    self.bucket.on_throttle()
+            else:
+                raise error
+        else:
+            raise NetatmoRepositoryError(f'Netatmo api did not return data for device {device_id}, module {module_id} '
+                                         f'after {self.max_attempts} attempts.')
+        if self.bucket:
+            self.bucket.on_success()
+        return data['body']
+
+    def _get_measurements_block_arrays(self, *,
+                                       device_data: lnetatmo.WeatherStationData,
+                                       device_id: str,
+                                       module_id: str,
+                                       measurements: ty.Sequence[str],
+                                       utc_period: UtcPeriod = None,
+                                       mtype: str = None
+                                       ) -> ty.Optional[ty.Tuple[np.ndarray, np.ndarray, float]]:
+        """Get one block of data for a specific device and set of measurements as arrays. Takes the same arguments as
+        _get_measurements_block, and optionally the measurements already joined into the comma separated mtype string
+        of the api, for callers fetching many blocks.
 
-    def add_action_timestamp_to_rate_limiters(self, timestamp: TimeType) -> None:
-        """Add a current action to rate limiters, so they keep track of actions."""
-        for limiter in self.rate_limiters:
-            limiter.add_action_timestamp(timestamp)
+        Returns:
+            The timestamps of the block, a value array with one row pr timestamp and one column pr measurement, and the
+            time step of the module. None if there is no data.
+        """
+
+        # The api takes whole unix seconds:
+        date_start = int(utc_period.start) if utc_period else None
+        date_end = int(utc_period.end) if utc_period else None
+
+        measurement_types_str = mtype or ','.join(measurements)
+
+        block_cache = self.block_cache if date_start is not None else None
+        cache_key = None
+        body = None
+        if block_cache:
+            cache_key = block_cache.create_key(device_id=device_id, module_id=module_id,
+                                               mtype=measurement_types_str, date_start=date_start)
+            body = block_cache.get(cache_key, date_end=date_end)
+        from_cache = body is not None
+
+        if not from_cache:
+            body = self._fetch_block_body(device_data=device_data,
+                                          device_id=device_id,
+                                          module_id=module_id,
+                                          mtype=measurement_types_str,
+                                          date_start=date_start,
+                                          date_end=date_end)
+
+        if not body:
+            return None
+
+        # The timestamps are the str keys of the json body. Convert them straight into a float array:
+        t = np.fromiter(map(float, body.keys()), dtype=np.float64, count=len(body))
+        if cache_key and not from_cache and block_cache.is_final(body=body, last_time=t[-1], now=float(utctime_now())):
+            block_cache.put(cache_key, body)
+
+        dt_mode = self._dt_mode_cache.get((device_id, module_id))
+        if dt_mode is None or not self._time_step_is_consistent(t, dt_mode):
+            dt_mode = self._find_time_step(t)
+            self._dt_mode_cache[(device_id, module_id)] = dt_mode
+
+        # One row pr timestamp and one column pr measurement. Missing values (None) become nan as float64. Converting
+        # one flat list is faster than converting a list of rows:
+        flat_values = list(chain.from_iterable(body.values()))
+        if len(flat_values) != len(t) * len(measurements):
+            raise NetatmoRepositoryError(f'Netatmo api returned {len(flat_values)} values for {len(t)} timestamps and '
+                                         f'{len(measurements)} measurements.')
+        values = np.array(flat_values, dtype=np.float64).reshape(len(t), len(measurements))
+        return t, values, dt_mode
 
     @staticmethod
-    def set_none_to_nan(values: ty.Sequence[ty.Union[Number, NoneType]]) -> ty.Sequence[ty.Union[Number, NanType]]:
-        """Method that replaces None with np.nan in a sequence."""
-        return [np.nan if value is None else value for value in values]
+    def _find_time_step(t: np.ndarray) -> float:
+        """Return the most common time step between the timestamps in t (excluding the last, possibly partial step).
+        Falls back to the Netatmo sampling interval if there are too few timestamps to tell."""
+        dt = np.diff(t[:-1]) if len(t) > 2 else np.diff(t)
+        if not len(dt):
+            return DEFAULT_TIME_STEP
+        dt_values, dt_counts = np.unique(dt, return_counts=True)
+        return float(dt_values[dt_counts.argmax()])
+
+    @staticmethod
+    def _time_step_is_consistent(t: np.ndarray, dt_mode: float) -> bool:
+        """Check in constant time that a known time step still fits a block: the mean step is never shorter than the
+        most common step, and only longer when there are gaps in the data. A mean step of less than dt_mode or more
+        than twice dt_mode means the module has changed its sampling interval."""
+        if len(t) < 2:
+            return True
+        mean_dt = (t[-1] - t[0]) / (len(t) - 1)
+        return dt_mode * 0.99 <= mean_dt < dt_mode * 2
+
+    @staticmethod
+    def _create_time_series(t: np.ndarray, values: np.ndarray, end: float) -> ty.List[TimeSeries]:
+        """Create one TimeSeries pr column of values, on a time axis with points t that ends at end."""
+        ta = TimeAxisByPoints(t.tolist() + [end])
+        # Rows of the contiguous transpose can be handed to shyft as arrays, without creating a Python float pr value:
+        columns = np.ascontiguousarray(values.T)
+        return [TimeSeries(ta, DoubleVector.from_numpy(column), POINT_INSTANT_VALUE) for column in columns]
 
     def _get_measurements_block(self, *,
                                 device_data: lnetatmo.WeatherStationData,
@@ -112,40 +466,18 @@ class NetatmoRepository(DataCollectionRepository):
         Returns:
             A TsVector with timeseries containing data for each measurement type, in the order of the input.
         """
-
-        date_start = float(utc_period.start) if utc_period else None
-        date_end = float(utc_period.end) if utc_period else None
-
-        self.wait_for_rate_limiters()
-        self.add_action_timestamp_to_rate_limiters(utctime_now())
-
-        measurement_types_str = ','.join([m for m in measurements])
-
-        data = device_data.getMeasure(
-            device_id=device_id,
-            module_id=module_id,
-            scale='max',
-            mtype=measurement_types_str,
-            date_begin=date_start,
-            date_end=date_end)
-
-        if not data['body']:
+        block = self._get_measurements_block_arrays(device_data=device_data,
+                                                    device_id=device_id,
+                                                    module_id=module_id,
+                                                    measurements=measurements,
+                                                    utc_period=utc_period)
+        if block is None:
             # noinspection PyArgumentList
-            output = [TimeSeries() for _ in measurements]
-        else:
-            t = [float(timestamp) for timestamp in data['body'].keys()]
-            # Add an additional timestep fmod(dt) forward in time to indicate the validness of the last value.
-            dt_list = [t2 - t1 for t1, t2 in zip(t[0:-2], t[1:-1])]
-            dt_mode = max(set(dt_list), key=dt_list.count)
-            ta = TimeAxisByPoints(t + [t[-1] + dt_mode])
+            return TsVector([TimeSeries() for _ in measurements])
 
-            values_pr_time = [value for value in data['body'].values()]
-            values = list(map(list, zip(*values_pr_time)))
-
-            # Remove nan:
-            output = [TimeSeries(ta, self.set_none_to_nan(vector), POINT_INSTANT_VALUE) for vector in values]
-
-        return TsVector(output)
+        t, values, dt_mode = block
+        # Add an additional timestep fmod(dt) forward in time to indicate the validness of the last value.
+        return TsVector(self._create_time_series(t, values, t[-1] + dt_mode))
 
     def get_measurements(self, *,
                          device_data: lnetatmo.WeatherStationData,
@@ -169,35 +501,41 @@ class NetatmoRepository(DataCollectionRepository):
             A TsVector with timeseries containing data for each measurement type, in the order of the input.
         """
 
+        # The blocks are collected as arrays, and the timeseries are created once all blocks are fetched:
+        t_chunks = []
+        value_chunks = []
+        mtype = ','.join(measurements)
         result_end = utc_period.start
-        # noinspection PyArgumentList
-        output = [TimeSeries() for _ in measurements]
         while result_end < utc_period.end:
             utc_period = UtcPeriod(result_end, utc_period.end)  # Define a UtcPeriod for the remaining data.
 
-            result = self._get_measurements_block(
+            block = self._get_measurements_block_arrays(
                 device_data=device_data,
                 device_id=station_id,
                 module_id=module_id,
                 measurements=measurements,
-                utc_period=utc_period)
+                utc_period=utc_period,
+                mtype=mtype)
 
-            if not any([bool(ts) for ts in result]):  # None data in period. Return blank.
+            if block is None:  # None data in period. Return blank.
                 break
-            for ind, res in enumerate(result):
-                if res:
-                    if not output[ind]:
-                        output[ind] = res
-                    else:
-                        output[ind] = output[ind].extend(res)
-
-            result_end = result[0].time_axis.time_points_double[-1]  # Set the start of the new calls UtcPeriod.
+            t, values, dt_mode = block
+            if t_chunks and t[0] > result_end:  # A gap between blocks is nan, as when extending timeseries.
+                t_chunks.append(np.array([result_end]))
+                value_chunks.append(np.full((1, values.shape[1]), np.nan))
+            t_chunks.append(t)
+            value_chunks.append(values)
+
+            result_end = t[-1] + dt_mode  # Set the start of the new calls UtcPeriod.
             # noinspection PyArgumentList
-            logging.info(f'Got {len(result[0])} data points from '
-                         f'{self.utc.to_string(result[0].time_axis.time_points_double[0])} to '
+            logging.info(f'Got {len(t)} data points from '
+                         f'{self.utc.to_string(t[0])} to '
                          f'{self.utc.to_string(result_end)}')
 
-        return TsVector(output)
+        if not t_chunks:
+            # noinspection PyArgumentList
+            return TsVector([TimeSeries() for _ in measurements])
+        return TsVector(self._create_time_series(np.concatenate(t_chunks), np.concatenate(value_chunks), result_end))
 
     def read(self, list_of_ts_id: ty.Sequence[str], period: UtcPeriod) -> ty.Dict[str, TimeSeries]:
         """Take a sequence of strings identifying specific timeseries and get data from these series according to
@@ -214,8 +552,9 @@ class NetatmoRepository(DataCollectionRepository):
             A TsVector containing the resulting timeseries containing data enough to cover the query period.
         """
 
-        return {ts_id: ts for ts_id, ts in zip(list_of_ts_id, self.read_callback(ts_ids=StringVector([list_of_ts_id]),
-                                                                                 read_period=period))}
+        ts_ids = list_of_ts_id if isinstance(list_of_ts_id, StringVector) else StringVector(list_of_ts_id)
+
+        return dict(zip(ts_ids, self.read_callback(ts_ids=ts_ids, read_period=period)))
 
     def read_callback(self, ts_ids: StringVector, read_period: UtcPeriod) -> TsVector:
         """This callback is passed as the default read_callback for a shyft.time_series.DtsServer.
@@ -228,41 +567,57 @@ class NetatmoRepository(DataCollectionRepository):
             A TsVector containing the resulting timeseries containing data enough to cover the query period.
         """
 
-        device_data, domain = self.create_netatmo_connection()
-        data = dict()  # Group ts_ids by repo.name (scheme).
+        device_data, domain = self.ensure_login()
+        data = dict()  # Group ts_ids by station and module, so all measurements of a module are fetched together.
         for enum, ts_id in enumerate(ts_ids):
             ts_id_props = parse_ts_id(ts_id=ts_id)
             measurement = domain.get_measurement(**ts_id_props)
 
-            if measurement.module.id not in data:
-                data[measurement.module.id] = []
-            data[measurement.module.id].append(
-                dict(enum=enum, ts=None, measurement=measurement))
+            key = (measurement.station.id, measurement.module.id)
+            if key not in data:
+                data[key] = []
+            data[key].append((enum, measurement))
+
+        output = [None] * len(ts_ids)  # Filled in the order of ts_ids.
+        # The modules are independent, so they are fetched in parallel. The token bucket and the concurrency limiter
+        # are shared by all threads, so the api limits still hold:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(data), self.concurrency.max_limit))) as executor:
+            futures = {executor.submit(self._read_module,
+                                       device_data=device_data,
+                                       station_id=station_id,
+                                       module_id=module_id,
+                                       measurement_types=[measurement.data_type.name for _, measurement in items],
+                                       read_period=read_period): items
+                       for (station_id, module_id), items in data.items()}
+            for future in as_completed(futures):
+                ts_by_type = future.result()
+                for enum, measurement in futures[future]:
+                    output[enum] = ts_by_type[measurement.data_type.name]
+
+        return TsVector(output)
 
-        for module_id in data:
-            measurements = [meas['measurement'] for meas in data[module_id]]
+    def _read_module(self, *,
+                     device_data: lnetatmo.WeatherStationData,
+                     station_id: str,
+                     module_id: str,
+                     measurement_types: ty.Sequence[str],
+                     read_period: UtcPeriod) -> ty.Dict[str, TimeSeries]:
+        """Get data for a set of measurement types from one module.
 
-            if module_id == measurements[0].station.id:  # The current module is the actual station itself.
-                module_id_arg = None
-            else:
-                module_id_arg = module_id
-            measurement_types = [m.data_type.name for m in measurements]
-            tsvec = self.get_measurements(device_data=device_data,
-                                          station_id=measurements[0].station.id,
-                                          module_id=module_id_arg,
-                                          measurements=measurement_types,
-                                          utc_period=read_period
-                                          )
-            for index, ts in enumerate(tsvec):
-                data[module_id][index]['ts'] = ts
-
-        # Collapse nested lists and sort by initial enumerate:
-        transpose_data = []
-        for items in data.values():
-            transpose_data.extend(items)
-        sort = sorted(transpose_data, key=lambda item: item['enum'])
-
-        return TsVector([item['ts'] for item in sort])
+        Returns:
+            The timeseries for each of the measurement types, keyed by measurement type.
+        """
+        if module_id == station_id:  # The current module is the actual station itself.
+            module_id = None
+        # A measurement can be asked for more than once, but it only needs to be fetched once:
+        measurement_types = list(dict.fromkeys(measurement_types))
+        tsvec = self.get_measurements(device_data=device_data,
+                                      station_id=station_id,
+                                      module_id=module_id,
+                                      measurements=measurement_types,
+                                      utc_period=read_period
+                                      )
+        return dict(zip(measurement_types, tsvec))
 
     def find_callback(self, query: str) -> TsInfoVector:
         """This callback is passed as the default find_callback for a shyft.time_series.DtsServer.
@@ -286,7 +641,7 @@ class NetatmoRepository(DataCollectionRepository):
             A sequence of results matching the query.
         """
         info = parse_ts_query(ts_query=query)
-        domain = self.create_netatmo_connection()[1]
+        domain = self.ensure_login()[1]
         meas = domain.get_measurement(**info)
 
         # noinspection PyArgumentList
@@ -51,11 +51,18 @@ class EnvVarConfig:
     """Superclass containing methods for verifying and getting environment variables."""
 
     @staticmethod
-    def verify_env_var(var: str) -> str:
-        """Simple check if variable exists in environment."""
-        if var not in os.environ:
+    def require_env_var(var: str) -> str:
+        """Get the value from a named environment variable, and raise an EnvironmentError if it is missing."""
+        value = os.environ.get(var)
+        if value is None:
             raise EnvironmentError(f"Can't find environment variable {var}. "
                                    f"Closest match is {tregex.find_best(var, [var for var in os.environ])}.")
+        return value
+
+    @classmethod
+    def verify_env_var(cls, var: str) -> str:
+        """Simple check if variable exists in environment."""
+        cls.require_env_var(var)
         return var
 
     @staticmethod
@@ -73,7 +80,8 @@ class EncryptedEnvVarConfig(EnvVarConfig):
 
     def get_env_var(self, var: str) -> str:
         """Get the value from an encrypted, named environment variable."""
+        value = os.environ.get(var, None)
         try:
-            return self.engine.decrypt(os.environ.get(var, None))
+            return self.engine.decrypt(value)
         except InvalidToken:
-            raise EncryptedEnvVarError(f'Cannot decrypt environment variable {var} with key {os.environ.get(var, None)}')
+            raise EncryptedEnvVarError(f'Cannot decrypt environment variable {var} with key {value}')
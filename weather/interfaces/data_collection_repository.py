@@ -11,6 +11,10 @@ from shyft.repository.interfaces import TsRepository
 class DataCollectionRepository(TsRepository):
     """DataCollectionRepository is an extension of the TsRepository that also provides callbacks for """
 
+    # Seconds a DtssHost may reuse the result of a find_callback for an identical query. 0 disables the reuse, which
+    # is the right choice for repositories whose find results must reflect every call.
+    find_cache_ttl: float = 0
+
     @property
     @abstractmethod
     def name(self) -> str:
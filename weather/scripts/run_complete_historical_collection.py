@@ -4,8 +4,11 @@ It contains an extra layer of rate limiters to prevent being kicked out of the N
 import os
 import sys
 import socket
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from itertools import chain
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 import shyft.time_series as st
 
@@ -13,9 +16,11 @@ from weather.service.data_collection_task import DataCollectionTask, DataCollect
 from weather.service.dtss_host import DtssHostEnvironmentVariablesConfig
 from weather.data_sources.netatmo.domain import NetatmoDomain
 from weather.data_sources.netatmo.repository import NetatmoEncryptedEnvVarConfig
-from weather.data_sources.netatmo.identifiers import create_ts_netatmo
+from weather.data_sources.netatmo.identifiers import create_ts_netatmo_batch
 
 
+HOSTNAME = socket.gethostname()
+
 # Get password and salt for decrypting environment variables.
 env_pass = sys.argv[1]
 env_salt = sys.argv[2]
@@ -38,17 +43,23 @@ dtss_config = DtssHostEnvironmentVariablesConfig(
 
 if __name__ == '__main__':
     # Initiate log
+    log_path = os.path.join(dtss_config.log_directory, 'data_collection')
+    # Threads only put records on a queue, and a single listener thread writes them to the console and log file:
+    log_queue = queue.Queue(-1)
     # noinspection PyArgumentList
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-            TimedRotatingFileHandler(filename=os.path.join(dtss_config.log_directory, 'data_collection'),
-                                     when="d",
-                                     interval=1,
-                                     backupCount=10)
-        ])
+        handlers=[QueueHandler(log_queue)])
+    log_listener = QueueListener(
+        log_queue,
+        logging.StreamHandler(),
+        TimedRotatingFileHandler(filename=log_path,
+                                 when="d",
+                                 interval=1,
+                                 backupCount=10))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 
     # Get the timeseries we want this instance to read:
@@ -58,29 +69,25 @@ if __name__ == '__main__':
         client_id=netatmo_config.client_id,
         client_secret=netatmo_config.client_secret)
 
-    # Create a list of ts_ids to read and a corresponding list of ts_ids to store.:
-    measurements = [measurement
-                    for station in domain.stations
-                    for module in station.modules
-                    for measurement in module.measurements]
-    read_timeseries = [create_ts_netatmo(measurement) for measurement in measurements]
-    store_ts_ids = [measurement.ts_id for measurement in measurements]
+    # Get the measurements we want to read and store:
+    modules = chain.from_iterable(station.modules for station in domain.stations)
+    measurements = list(chain.from_iterable(module.measurements for module in modules))
 
     # Initialize netatmo collection:
     logging.info('Attempting to create dts client.')
-    read_dtss_address = f'{socket.gethostname()}:{os.environ["DTSS_PORT_NUM"]}'
+    read_dtss_address = f'{HOSTNAME}:{dtss_config.port_num}'
     logging.info('Successfully created dts client.')
     cal = st.Calendar('Europe/Oslo')
 
     netatmo_complete = DataCollectionTask(
             task_name='netatmo_complete',
             read_dtss_address=read_dtss_address,
-            read_ts=read_timeseries,
+            read_ts=create_ts_netatmo_batch(measurements),
             read_period=DataCollectionPeriodAbsolute(
                 start=cal.time(2019, 3, 1),  # For start of operation. No specified end means now.
                 wait_time=24 * 3600),  # Every day, not used.
             store_dtss_address=read_dtss_address,
-            store_ts_ids=store_ts_ids
+            store_ts_ids=(measurement.ts_id for measurement in measurements)
         )
 
     # Perform data collection:
@@ -3,15 +3,23 @@
 import os
 import sys
 import socket
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from itertools import chain
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+
+from shyft.time_series import TsVector
 
 from weather.service.data_collection_task import DataCollectionTask, DataCollectionPeriodRelative
-from weather.service.service_manager import Service, ServiceManager
+from weather.service.batching_dts_client import close_shared_clients
+from weather.service.service_manager import Service, ServiceManager, wait_for_stop_signal
 from weather.service.dtss_host import DtssHostEnvironmentVariablesConfig
 from weather.data_sources.netatmo.domain import NetatmoDomain
 from weather.data_sources.netatmo.repository import NetatmoEncryptedEnvVarConfig
-from weather.data_sources.netatmo.identifiers import create_ts_netatmo
+from weather.data_sources.netatmo.identifiers import create_ts_netatmo_batch
+
+HOSTNAME = socket.gethostname()
 
 # Get password and salt for decrypting environment variables.
 env_pass = sys.argv[1]
@@ -35,17 +43,23 @@ dtss_config = DtssHostEnvironmentVariablesConfig(
 
 if __name__ == '__main__':
     # Initiate log
+    log_path = os.path.join(dtss_config.log_directory, 'data_collection')
+    # Threads only put records on a queue, and a single listener thread writes them to the console and log file:
+    log_queue = queue.Queue(-1)
     # noinspection PyArgumentList
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-            TimedRotatingFileHandler(filename=os.path.join(dtss_config.log_directory, 'data_collection'),
-                                     when="d",
-                                     interval=1,
-                                     backupCount=10)
-        ])
+        handlers=[QueueHandler(log_queue)])
+    log_listener = QueueListener(
+        log_queue,
+        logging.StreamHandler(),
+        TimedRotatingFileHandler(filename=log_path,
+                                 when="d",
+                                 interval=1,
+                                 backupCount=10))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 
     # Get the timeseries we want this instance to read:
@@ -56,18 +70,16 @@ if __name__ == '__main__':
         client_secret=netatmo_config.client_secret)
 
     # Create a list of ts_ids to read and a corresponding list of ts_ids to store.:
-    measurements = [measurement for station in domain.stations for module in station.modules for measurement in module.measurements]
-    read_timeseries = [create_ts_netatmo(measurement) for measurement in measurements]
-    store_ts_ids = [measurement.ts_id for measurement in measurements]
+    modules = chain.from_iterable(station.modules for station in domain.stations)
+    measurements = list(chain.from_iterable(module.measurements for module in modules))
+    # Both tasks read and store the same timeseries, so they share one TsVector and one tuple of ts_ids:
+    read_timeseries = TsVector(create_ts_netatmo_batch(measurements))
+    store_ts_ids = tuple(measurement.ts_id for measurement in measurements)
 
     # Initialize DataCollectionServices:
 
     # Initialize netatmo collection:
-    read_dtss_address = f'{socket.gethostname()}:{os.environ["DTSS_PORT_NUM"]}'
-
-    from shyft.time_series import DtsClient
-
-    c = DtsClient(read_dtss_address)
+    read_dtss_address = f'{HOSTNAME}:{dtss_config.port_num}'
 
     netatmo_short = DataCollectionTask(
         task_name='netatmo_short',
@@ -91,19 +103,18 @@ if __name__ == '__main__':
         )
 
     services = ServiceManager(health_check_interval=60 * 10)
-    services.add_service(
-        Service(name=netatmo_short.name,
-                task=netatmo_short.collect_data,
-                task_interval=netatmo_short.read_period.wait_time,
-                health_check_action=netatmo_short.health_check,
-                restart_action=netatmo_short.restart_clients)
-    )
-    services.add_service(
-        Service(name=netatmo_long.name,
-                task=netatmo_long.collect_data,
-                task_interval=netatmo_long.read_period.wait_time,
-                health_check_action=netatmo_long.health_check,
-                restart_action=netatmo_long.restart_clients)
-    )
+    services.add_services([
+        Service(name=task.name,
+                task=task.collect_data,
+                task_interval=task.read_period.wait_time,
+                health_check_action=task.health_check,
+                restart_action=task.restart_clients)
+        for task in (netatmo_short, netatmo_long)
+    ])
+    services.add_stop_callback(close_shared_clients)  # The tasks share their DtsClients.
 
     services.start_services()
+    try:
+        wait_for_stop_signal()
+    finally:
+        services.stop_services()
@@ -1,14 +1,15 @@
 """This script file starts the DtssHost service on a port specified in ENV."""
 import sys
 import os
-import time
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 from weather.data_sources.netatmo.repository import NetatmoRepository, NetatmoEncryptedEnvVarConfig
 from weather.service.dtss_host import DtssHost, DtssHostEnvironmentVariablesConfig
 from weather.data_sources.heartbeat import create_heartbeat_request
-from weather.service.service_manager import Service, ServiceManager
+from weather.service.service_manager import Service, ServiceManager, wait_for_stop_signal
 from shyft.time_series import DtsClient
 
 # Get password and salt for decrypting environment variables.
@@ -45,35 +46,56 @@ dtss_config = DtssHostEnvironmentVariablesConfig(
 
 if __name__ == '__main__':
     # Initialize log:
+    log_path = os.path.join(dtss_config.log_directory, 'dtss')
+    # Threads only put records on a queue, and a single listener thread writes them to the console and log file:
+    log_queue = queue.Queue(-1)
     # noinspection PyArgumentList
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-            TimedRotatingFileHandler(filename=os.path.join(dtss_config.log_directory, 'dtss'),
-                                     when="d",
-                                     interval=1,
-                                     backupCount=10)
-        ])
+        handlers=[QueueHandler(log_queue)])
+    log_listener = QueueListener(
+        log_queue,
+        logging.StreamHandler(),
+        TimedRotatingFileHandler(filename=log_path,
+                                 when="d",
+                                 interval=1,
+                                 backupCount=10))
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
     # Initialize DtssHost:
     host = DtssHost(**dtss_config)
     host.start()
+
+    # The health check reuses one client and one request instead of creating them on every check:
+    health_check_client = DtsClient(host.address)
+    health_check_request = create_heartbeat_request(f'Startup script check every {health_check_interval} s')
+
+    def dtss_health_check() -> bool:
+        """Perform a dummy find-request and expect a non-empty response. The client is only reconnected when the
+        request fails, e.g. after the host has restarted."""
+        global health_check_client
+        try:
+            return bool(health_check_client.find(health_check_request))
+        except RuntimeError as e:
+            logging.warning(f'Health check request failed, reconnecting: {e}')
+        health_check_client = DtsClient(host.address)
+        try:
+            return bool(health_check_client.find(health_check_request))
+        except RuntimeError:
+            return False
+
     # Create a ServiceManager to monitor the health of the Dtss every 30 minutes.
-    # health_check_action performs a dummy find-request and expects a non-empty response.
     sm = ServiceManager(services=[
         Service(name='dtss_maintainer',
-                health_check_action=
-                lambda: bool(DtsClient(host.address).find(
-                    create_heartbeat_request(f'Startup script check every {health_check_interval} s'))),
+                health_check_action=dtss_health_check,
                 restart_action=host.restart
                 )], health_check_interval=health_check_interval)
 
     sm.start_services()
     try:
-        while True:
-            time.sleep(5)
+        wait_for_stop_signal()
     finally:
         sm.stop_services()
         host.stop()
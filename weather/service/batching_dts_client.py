@@ -0,0 +1,196 @@
+"""A DtsClient wrapper that coalesces concurrent evaluate and store calls into single requests."""
+import math
+import time
+import logging
+import threading
+import typing as ty
+
+import shyft.time_series as st
+
+
+class BatchingDtsClientError(Exception):
+    """Errors raised by the BatchingDtsClient."""
+    pass
+
+
+class _Batch:
+    """The timeseries collected from every caller waiting for the same request."""
+
+    def __init__(self) -> None:
+        self.timeseries: ty.List[st.TimeSeries] = []
+        self.callers = 0
+        self.done = threading.Event()
+        self.result: ty.Optional[st.TsVector] = None
+        self.error: ty.Optional[Exception] = None
+
+
+class BatchingDtsClient:
+    def __init__(self, address: str,
+                 max_delay: float = 0.005,
+                 period_resolution: float = 0,
+                 client_factory: ty.Callable[[str], st.DtsClient] = st.DtsClient) -> None:
+        """A client for a DtssHost that can be shared by several DataCollectionTasks. Calls to batch_evaluate for the
+        same period that arrive together are sent as one evaluate request, and each caller gets its own slice of the
+        result back. Calls to batch_store_ts are merged into one store_ts request the same way. Callers join a batch
+        until it is sent, and the first caller only waits max_delay for others when other calls are in progress.
+
+        Args:
+            address: The address of the DtssHost service.
+            max_delay: The number of seconds the first caller waits for other callers before the request is sent.
+            period_resolution: If set, evaluated periods are widened to whole multiples of this many seconds, so tasks
+                               asking for nearly the same period share a request, and get data outside the period
+                               they asked for. Default 0 evaluates the exact period.
+            client_factory: Callable creating the underlying DtsClient from the address.
+        """
+        self.address = address
+        self.max_delay = max_delay
+        self.period_resolution = period_resolution
+        self._client_factory = client_factory
+        self._client = client_factory(address)
+        self._client_lock = threading.Lock()  # The underlying client is used by one thread at a time.
+        self._pending: ty.Dict[ty.Hashable, _Batch] = {}
+        self._pending_lock = threading.Lock()
+        self._callers = 0  # Calls to batch_evaluate and batch_store_ts in progress.
+
+    def reconnect(self) -> None:
+        """Replace the underlying DtsClient with a new connection."""
+        with self._client_lock:
+            self._client = self._client_factory(self.address)
+
+    def close(self) -> None:
+        """Close the connection of the underlying DtsClient."""
+        with self._client_lock:
+            self._client.close()
+
+    def find(self, query: str) -> st.TsInfoVector:
+        """Perform a find request with the underlying DtsClient."""
+        with self._client_lock:
+            return self._client.find(query)
+
+    def store_ts(self, *args, **kwargs) -> None:
+        """Perform a store request with the underlying DtsClient."""
+        with self._client_lock:
+            self._client.store_ts(*args, **kwargs)
+
+    def batch_evaluate(self, tsv: ty.Sequence[st.TimeSeries], period: st.UtcPeriod) -> st.TsVector:
+        """Evaluate tsv for period, together with any other calls for the same period within max_delay.
+
+        Args:
+            tsv: The unbound timeseries to evaluate.
+            period: The period to evaluate them for. Widened to whole multiples of period_resolution, if it is set.
+
+        Returns:
+            A TsVector with the evaluated timeseries, in the same order as tsv.
+        """
+        period = self.round_period(period)
+
+        def evaluate(timeseries: ty.List[st.TimeSeries]) -> st.TsVector:
+            result = self._client.evaluate(st.TsVector(timeseries), period)
+            if len(result) != len(timeseries):
+                raise BatchingDtsClientError(f'{BatchingDtsClient.__name__} asked for {len(timeseries)} '
+                                             f'timeseries, but got {len(result)}.')
+            return result
+
+        result, offset, count = self._join_batch(('evaluate', float(period.start), float(period.end)), tsv, evaluate)
+        return st.TsVector([result[index] for index in range(offset, offset + count)])
+
+    def round_period(self, period: st.UtcPeriod) -> st.UtcPeriod:
+        """Widen period to whole multiples of period_resolution."""
+        if not self.period_resolution:
+            return period
+        start = math.floor(float(period.start) / self.period_resolution) * self.period_resolution
+        end = math.ceil(float(period.end) / self.period_resolution) * self.period_resolution
+        return st.UtcPeriod(st.time(start), st.time(end))
+
+    def batch_store_ts(self, tsv: ty.Sequence[st.TimeSeries], overwrite_on_write: bool = False) -> None:
+        """Store tsv, together with any other calls to batch_store_ts that arrive together, in one store_ts request.
+
+        Args:
+            tsv: The named timeseries with data to store.
+            overwrite_on_write: Passed on to DtsClient.store_ts.
+        """
+        def store(timeseries: ty.List[st.TimeSeries]) -> None:
+            self._client.store_ts(tsv=st.TsVector(timeseries), overwrite_on_write=overwrite_on_write)
+
+        self._join_batch(('store', overwrite_on_write), tsv, store)
+
+    def _join_batch(self, key: ty.Hashable,
+                    timeseries: ty.Sequence[st.TimeSeries],
+                    send: ty.Callable[[ty.List[st.TimeSeries]], ty.Any]) -> ty.Tuple[ty.Any, int, int]:
+        """Add timeseries to the pending batch for key, and wait until the batch is sent. The first caller of a batch
+        sends it, and callers keep joining until the request is sent. If the batch fails, every caller sends its own
+        timeseries separately, so an error is only raised to the caller it belongs to.
+
+        Returns:
+            The result of send, and the offset and number of this caller's timeseries within it.
+        """
+        with self._pending_lock:
+            self._callers += 1
+            others_in_progress = self._callers > 1
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            batch.callers += 1
+            offset = len(batch.timeseries)
+            batch.timeseries.extend(timeseries)
+            count = len(batch.timeseries) - offset
+
+        try:
+            if leader:
+                if others_in_progress:
+                    # Give the other callers a moment to join:
+                    time.sleep(self.max_delay)
+                with self._client_lock:
+                    # Close the batch when the client is free, so callers arriving meanwhile are included:
+                    with self._pending_lock:
+                        del self._pending[key]
+                    try:
+                        batch.result = send(batch.timeseries)
+                    except Exception as e:
+                        batch.error = e
+                    finally:
+                        batch.done.set()
+                if batch.callers > 1:
+                    logging.info('%s: sent %d timeseries for %d callers in one %s request.',
+                                 BatchingDtsClient.__name__, len(batch.timeseries), batch.callers, key[0])
+            else:
+                batch.done.wait()
+
+            if batch.error is None:
+                return batch.result, offset, count
+            if batch.callers == 1:
+                raise batch.error
+            logging.warning('%s: %s request for %d callers failed, sending each part separately: %s',
+                            BatchingDtsClient.__name__, key[0], batch.callers, batch.error)
+            with self._client_lock:
+                return send(batch.timeseries[offset:offset + count]), 0, count
+        finally:
+            with self._pending_lock:
+                self._callers -= 1
+
+
+_SHARED_CLIENTS: ty.Dict[str, BatchingDtsClient] = {}
+_SHARED_CLIENTS_LOCK = threading.Lock()
+
+
+def get_shared_client(address: str) -> BatchingDtsClient:
+    """Return the BatchingDtsClient for address that is shared within the process, and create it on first use. Every
+    task using the same DtssHost then shares one connection."""
+    with _SHARED_CLIENTS_LOCK:
+        client = _SHARED_CLIENTS.get(address)
+        if client is None:
+            client = _SHARED_CLIENTS[address] = BatchingDtsClient(address)
+        return client
+
+
+def close_shared_clients() -> None:
+    """Close every shared BatchingDtsClient and forget them, so the next get_shared_client call connects again."""
+    with _SHARED_CLIENTS_LOCK:
+        clients = list(_SHARED_CLIENTS.values())
+        _SHARED_CLIENTS.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logging.warning('%s: could not close the client for %s: %s', BatchingDtsClient.__name__, client.address, e)
@@ -1,12 +1,13 @@
 """A DataCollectionService is a service that communicates with a DtssHost and stores data to the DtssHost according
 to a set of ts_ids, timespans and intervals."""
 import logging
-from typing import Sequence, Union, Optional
+from typing import Iterable, Union, Optional
 from abc import ABC, abstractmethod
 
 import shyft.time_series as st
 
 from weather.data_sources.heartbeat import create_heartbeat_request
+from weather.service.batching_dts_client import BatchingDtsClient, get_shared_client
 
 Number = Union[float, int]
 TimeType = Union[st.time, Number]
@@ -42,32 +43,37 @@ class DataCollectionPeriodRelative(DataCollectionPeriodBase):
         self.wait_time = wait_time
         self.start_offset = start_offset
         self.end_offset = end_offset
+        # The offsets are converted to st.time once, so period() only does arithmetic on st.time:
+        self._start_offset = st.time(start_offset)
+        self._end_offset = st.time(end_offset)
 
     def period(self) -> st.UtcPeriod:
         """Return a UtcPeriod correctly defined for a data query right now."""
         now = st.utctime_now()
-        return st.UtcPeriod(now - self.start_offset, now - self.end_offset)
+        return st.UtcPeriod(now - self._start_offset, now - self._end_offset)
 
 
 class DataCollectionPeriodAbsolute(DataCollectionPeriodBase):
     """Class that defines a period for which we collect data. Periods are defined as offsets from utc_now."""
 
-    def __init__(self, start: TimeType, wait_time: TimeType, end: Optional[TimeType] = st.utctime_now()):
+    def __init__(self, start: TimeType, wait_time: TimeType, end: Optional[TimeType] = None):
         """DataCollectionPeriods are used to define the period query pattern for a DataCollectionSerive. The
         DataCollectionPeriod defines the start, stop of every individual period, and the wait time between each query.
 
         Args:
-            start_offset: The offset in seconds from now that defines the start of the queried data period.
-            end_offset: The offset in seconds from now that defines the end of the queried data period. Default=0.
+            start: The start of the queried data period.
             wait_time: The wait time in seconds between individual queries.
+            end: The end of the queried data period. Defaults to the time of construction.
         """
         self.wait_time = wait_time
         self.start = start
-        self.end = end
+        self.end = end if end is not None else st.utctime_now()
+        self._period = st.UtcPeriod(self.start, self.end)
 
     def period(self) -> st.UtcPeriod:
-        """Return a UtcPeriod correctly defined for a data query right now."""
-        return st.UtcPeriod(self.start, self.end)
+        """Return a UtcPeriod correctly defined for a data query right now. The period is fixed, so it is created
+        once."""
+        return self._period
 
 
 class DataCollectionTask:
@@ -76,10 +82,11 @@ to a set of ts_ids, timespans and intervals."""
 
     def __init__(self, task_name: str,
                  read_dtss_address: str,
-                 read_ts: Sequence[st.TimeSeries],
+                 read_ts: Iterable[st.TimeSeries],
                  read_period: DataCollectionPeriodBase,
                  store_dtss_address: str,
-                 store_ts_ids: Sequence[str]
+                 store_ts_ids: Iterable[str],
+                 shared_read_client: Optional[BatchingDtsClient] = None
                  ) -> None:
         """A DataCollectionTask is a tool for regularly querying a dtss for data, and then storing the data in a
         corresponding dtss using the store function.
@@ -87,49 +94,51 @@ to a set of ts_ids, timespans and intervals."""
         Args:
             task_name: The name of the task, so it can be identified in logs.
             read_dtss_address: The address of the DtssHost service you want to read data from.
-            read_ts: A list of unbound timeseries that can be found in the read_client.
+            read_ts: The unbound timeseries that can be found in the read_client, as any iterable. Tasks reading the
+                same timeseries can share one st.TsVector, which is then used as is.
             read_period: The relative period we want to read data from.
             store_dtss_address: The address of the DtssHost service you want to store the data in.
-            store_ts_ids: A list of strings that we want to store the timeseries as in the store DtssHost.
+            store_ts_ids: The strings that we want to store the timeseries as in the store DtssHost, as any iterable.
+            shared_read_client: A BatchingDtsClient for read_dtss_address. Defaults to the client shared by every
+                task in the process that reads from the same address. Reads for the same period from several tasks
+                are sent as one request.
         """
         self.name = task_name
         self.read_dtss_address = read_dtss_address
-        self.read_ts = read_ts
+        # Iterables (e.g. generators) are materialized once here, so callers do not need to build lists first:
+        self.read_ts = read_ts if isinstance(read_ts, st.TsVector) else st.TsVector(list(read_ts))
         self.read_period = read_period
         self.store_dtss_address = store_dtss_address
-        self.store_ts_ids = store_ts_ids
-        self.read_client: st.DtsClient = None
-        self.store_client: st.DtsClient = None
-
-        self.restart_clients()
+        self.store_ts_ids = tuple(store_ts_ids)
+        # Clients are shared with the other tasks using the same DtssHost, so connections are only made once:
+        self.read_client = shared_read_client if shared_read_client else get_shared_client(read_dtss_address)
+        self.store_client = get_shared_client(store_dtss_address)
 
     def restart_clients(self) -> None:
-        """Initiate DtsClients."""
-        if self.read_client:
-            del self.read_client
-        self.read_client = st.DtsClient(self.read_dtss_address)
-
-        if self.store_client:
-            del self.store_client
-        self.store_client = st.DtsClient(self.store_dtss_address)
+        """Reconnect the DtsClients. Usually after a failed health_check."""
+        self.read_client.reconnect()
+        if self.store_client is not self.read_client:
+            self.store_client.reconnect()
 
     def perform_read(self) -> st.TsVector:
         """Perform a read query that returns a ts_vector with the queried data."""
-        return self.read_client.evaluate(st.TsVector(self.read_ts),
-                                         self.read_period.period())
+        return self.read_client.batch_evaluate(self.read_ts, self.read_period.period())
 
     def perform_store(self, store_data: st.TsVector) -> None:
         """Perform a store query that stores the data in store_data according to the ts_names in store_ts_ids."""
-        self.store_client.store_ts(
-            tsv=st.TsVector([st.TimeSeries(ts_id, ts) for ts_id, ts in zip(self.store_ts_ids, store_data)]),
-            overwrite_on_write=False
-        )
+        # Every cycle reads new data, so the named timeseries must be created again. map pairs the names with the
+        # data without a Python-level loop:
+        self.store_client.batch_store_ts(list(map(st.TimeSeries, self.store_ts_ids, store_data)),
+                                         overwrite_on_write=False)
 
     def health_check(self) -> bool:
         """Simple query towards both read_client and store_client to verify integrity of DataCollectionTask."""
         request = create_heartbeat_request(f'Health check from {self.name}')
         try:
-            return self.read_client.find(request) and self.store_client.find(request)
+            if self.store_client is self.read_client:
+                # Both ends use the same DtssHost and connection, so one request checks both:
+                return bool(self.read_client.find(request))
+            return bool(self.read_client.find(request)) and bool(self.store_client.find(request))
         except RuntimeError:
             return False
 
@@ -6,15 +6,21 @@ import typing as ty
 import logging
 import urllib
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from shyft.time_series import (DtsServer, DtsClient, StringVector, TsVector, UtcPeriod, TsInfoVector)
+from shyft.time_series import (DtsServer, DtsClient, StringVector, TsVector, UtcPeriod, TsInfoVector, TimeSeries)
 
 from weather.data_sources.heartbeat import HeartbeatRepository, create_heartbeat_request
 from weather.interfaces.data_collection_repository import DataCollectionRepository
 from weather.interfaces.config import RepositoryConfigBase, EnvVarConfig
 
 ConfigType = ty.Dict[str, object]
+HEARTBEAT_PREFIX = f'{HeartbeatRepository.name}://'
+FIND_CACHE_SIZE = 1024  # The maximum number of find results the DtssHost keeps for reuse.
 
 
 class DtssHostConfigurationError(Exception):
@@ -113,21 +119,36 @@ class DtssHost:
 
         self.data_collection_repositories = data_collection_repositories
         self.repos = None
+        self.repo_names: ty.FrozenSet[str] = frozenset()
+        # Recent find results for repositories with a find_cache_ttl, keyed on (query, time bucket):
+        self._find_cache: ty.Dict[ty.Tuple[str, int], TsInfoVector] = OrderedDict()
+        self._find_cache_lock = threading.Lock()
         self.initiate_repos()
         self.container_directory = container_directory
+        # Container paths that are known to exist on disk, so a restart does not need to touch the file system:
+        self._container_paths: ty.Dict[str, str] = {}
 
         # Initialize and configure server:
         self.dtss: DtsServer = None
+        self._client: ty.Optional[DtsClient] = None  # Client for verifying the server, kept while it runs.
+
+        # Worker threads for reading several repositories in parallel. Created on first use:
+        self._read_pool: ty.Optional[ThreadPoolExecutor] = None
+        self._read_pool_lock = threading.Lock()
 
     def initiate_repos(self) -> None:
         """Construct all the data collection repositories."""
         # Build a dictionary containing every available repository.
-        repos = [repo(**config) for repo, config in self.data_collection_repositories]
+        repos = (repo(**config) for repo, config in self.data_collection_repositories)
         self.repos: ty.Dict[str, DataCollectionRepository] = {repo.name: repo for repo in repos}
 
         # The HeartbeatRepository contains callbacks that return arbitrary responses to all calls.
         # This lets  ut verify that the service is running.
         self.repos[HeartbeatRepository.name] = HeartbeatRepository(host=self)
+        self.repo_names = frozenset(self.repos)  # Used to route urls, which happens for every ts_id.
+        self._heartbeat_repo = self.repos[HeartbeatRepository.name]
+        with self._find_cache_lock:
+            self._find_cache.clear()  # Results from the previous repositories are not reused.
 
     def make_server(self) -> DtsServer:
         """Construct and configure our DtsServer."""
@@ -139,15 +160,14 @@ class DtssHost:
         dtss.find_cb = self.find_callback
 
         # TimeSeries storage.
-        # Check if container directory exists, if not, create it.
-        if not os.path.exists(self.container_directory):
-            os.mkdir(self.container_directory)
-
-        # Check if repo containers exists, if not, create them, then add as containers.
+        # Create the repo containers (and the container directory) if they do not exist, then add as containers.
+        # Containers created by an earlier start in this process are reused as they are.
         for repo in self.repos:
-            repo_container = os.path.join(self.container_directory, repo)
-            if not os.path.exists(repo_container):
-                os.mkdir(repo_container)
+            repo_container = self._container_paths.get(repo)
+            if repo_container is None:
+                repo_container = os.path.join(self.container_directory, repo)
+                os.makedirs(repo_container, exist_ok=True)
+                self._container_paths[repo] = repo_container
             dtss.set_container(repo, repo_container)
 
         return dtss
@@ -164,9 +184,9 @@ class DtssHost:
 
         try:
             # Verify that server is running:
-            c = DtsClient(self.address)
-            response = c.find(create_heartbeat_request('startup verification'))
-            del c
+            if self._client is None:
+                self._client = DtsClient(self.address)
+            response = self._client.find(create_heartbeat_request('startup verification'))
             if not response:
                 raise DtssHostError('DtssHost is not responding to expected calls.')
         except DtssHostError:
@@ -178,9 +198,17 @@ class DtssHost:
             logging.info('DtssHost attempted to stop a server that isn''t running.')
         else:
             logging.info(f'DtssHost stop at port {self.port_num}.')
+            self._client = None
             self.dtss.clear()
-            del self.dtss
+            # The callbacks are bound methods of this host. Drop them, so the server does not keep the host (and every
+            # repository) alive after it is stopped:
+            self.dtss.cb = None
+            self.dtss.find_cb = None
             self.dtss = None
+        with self._read_pool_lock:
+            if self._read_pool:
+                self._read_pool.shutdown(wait=False)
+                self._read_pool = None
 
     def restart(self) -> None:
         """Restart the DtsServer."""
@@ -206,40 +234,80 @@ class DtssHost:
         Returns:
             A TsVector containing the resulting timeseries containing data enough to cover the query period.
         """
-        logging.info(f'DtssHost received read_callback for {len(ts_ids)} ts_ids for period {read_period}.')
-
-        data = dict()  # Group ts_ids by repo.name (scheme).
+        # Lazy formatting, so the period is only formatted when the record is actually logged:
+        logging.info('DtssHost received read_callback for %d ts_ids for period %s.', len(ts_ids), read_period)
+
+        if len(ts_ids):
+            # Most requests only hold ts_ids for one repository. That is checked with a cheap prefix scan that stops
+            # at the first ts_id from another repository, and the request is then passed on as it is:
+            repo_name = self.get_repo_name_from_url(ts_ids[0])
+            prefix = f'{repo_name}:'
+            if all(ts_id.startswith(prefix) for ts_id in ts_ids):
+                return self.repos[repo_name].read_callback(ts_ids=ts_ids, read_period=read_period)
+
+        # Group ts_ids by repo.name (scheme), and remember the position of each ts_id in the request:
+        groups: ty.Dict[str, ty.Tuple[ty.List[int], ty.List[str]]] = defaultdict(lambda: ([], []))
         for enum, ts_id in enumerate(ts_ids):
-            repo_name = self.get_repo_name_from_url(ts_id)
-            if repo_name not in data:
-                data[repo_name] = []
-            data[repo_name].append(dict(enum=enum, ts_id=ts_id, ts=None))
-
-        for repo_name in data:
-            tsvec = self.repos[repo_name].read_callback(
-                ts_ids=StringVector([ts['ts_id'] for ts in data[repo_name]]),
-                read_period=read_period)
-            for index, ts in enumerate(tsvec):
-                data[repo_name][index]['ts'] = ts
-
-        # Collapse nested lists and sort by initial enumerate:
-        transpose_data = []
-        for items in data.values():
-            transpose_data.extend(items)
-        sort = sorted(transpose_data, key=lambda item: item['enum'])
-
-        return TsVector([item['ts'] for item in sort])
+            indices, repo_ts_ids = groups[self.get_repo_name_from_url(ts_id)]
+            indices.append(enum)
+            repo_ts_ids.append(ts_id)
+
+        output: ty.List[ty.Optional[TimeSeries]] = [None] * len(ts_ids)
+
+        # The repositories are independent sources, so they are read in parallel:
+        executor = self._get_read_pool()
+        futures = {executor.submit(self.repos[repo_name].read_callback,
+                                   ts_ids=StringVector(repo_ts_ids),
+                                   read_period=read_period): indices
+                   for repo_name, (indices, repo_ts_ids) in groups.items()}
+        for future in as_completed(futures):
+            # Place each timeseries at the position of its ts_id in the request:
+            for enum, ts in zip(futures[future], future.result()):
+                output[enum] = ts
+
+        return TsVector(output)
+
+    def _get_read_pool(self) -> ThreadPoolExecutor:
+        """Return the pool used to read repositories in parallel, with one worker per repository."""
+        with self._read_pool_lock:
+            if not self._read_pool:
+                self._read_pool = ThreadPoolExecutor(max_workers=len(self.repos))
+            return self._read_pool
 
     def find_callback(self, query: str) -> TsInfoVector:
         """DtssHost.find:callback accepts a query string and returns metadata for any timeseries found."""
-        repo_name = self.get_repo_name_from_url(query)
-        return self.repos[repo_name].find_callback(query=query)
+        if query.startswith(HEARTBEAT_PREFIX):
+            # Health checks are the most frequent finds, so they skip the routing:
+            return self._heartbeat_repo.find_callback(query=query)
+        repo = self.repos[self.get_repo_name_from_url(query)]
+        if not repo.find_cache_ttl:
+            return repo.find_callback(query=query)
+
+        # Identical queries within the same time bucket get the same result:
+        key = (query, int(time.monotonic() // repo.find_cache_ttl))
+        with self._find_cache_lock:
+            result = self._find_cache.get(key)
+        if result is None:
+            result = repo.find_callback(query=query)
+            with self._find_cache_lock:
+                self._find_cache[key] = result
+                if len(self._find_cache) > FIND_CACHE_SIZE:
+                    self._find_cache.popitem(last=False)  # Evict the oldest result.
+        return result
 
     def get_repo_name_from_url(self, url: str) -> str:
         """Get the repo name (scheme) from a url, so that we can route it correctly."""
+        # Fast path: the scheme is everything before the first colon. urlparse is only needed for unusual urls.
+        scheme = url.partition(':')[0]
+        if scheme in self.repo_names:
+            return scheme
         parsed = urllib.parse.urlparse(url)
-        if parsed.scheme not in self.repos:
-            raise DtssHostError(f'ts_id scheme {parsed.scheme} does not match any '
-                                f'that are available for the DtssHost: '
-                                f'{", ".join(scheme for scheme in self.repos)}')
+        if parsed.scheme not in self.repo_names:
+            raise self._unknown_scheme_error(parsed.scheme)
         return parsed.scheme
+
+    def _unknown_scheme_error(self, scheme: str) -> DtssHostError:
+        """Create the error for a url with a scheme that does not match any repository."""
+        return DtssHostError(f'ts_id scheme {scheme} does not match any '
+                             f'that are available for the DtssHost: '
+                             f'{", ".join(name for name in self.repos)}')
@@ -6,10 +6,16 @@ This task is added as a ServiceTask is added to a Service with a heartbeat. The
 verifying if the ServiceTask loop is performing properly or not. If it is not performing, it will be restarted.
 """
 
-import logging
+import os
 import time
+import heapq
+import signal
+import logging
+import itertools
+import functools
 import threading
 import typing as ty
+from concurrent.futures import ThreadPoolExecutor, Future
 
 Number = ty.Union[float, int]
 
@@ -18,12 +24,35 @@ class ServiceError(Exception):
     """Exception raised by a service."""
 
 
+def wait_for_stop_signal(stop_event: ty.Optional[threading.Event] = None) -> None:
+    """Block the main thread until SIGINT or SIGTERM is received, or until stop_event is set by someone else. Used by
+    scripts to keep the process alive while services run in other threads, without waking up regularly. The previous
+    signal handlers are restored when the wait is over.
+
+    Args:
+        stop_event: Event that stops the wait when set. A new Event is used if not given.
+    """
+    stop_event = stop_event if stop_event else threading.Event()
+    previous_handlers = {signal_number: signal.signal(signal_number, lambda *_: stop_event.set())
+                         for signal_number in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        # Windows does not deliver Ctrl+C to a thread blocked on a lock, so there the event is polled instead.
+        timeout = 1 if os.name == 'nt' else None
+        while not stop_event.wait(timeout):
+            pass
+    finally:
+        for signal_number, handler in previous_handlers.items():
+            signal.signal(signal_number, handler)
+    logging.info('Stop signal received.')
+
+
 class ServiceLoop:
-    """Service loop is a callable container for a task that is called by threading.Thread."""
+    """Service loop is a callable container for a task that is performed regularly by a ServiceScheduler."""
 
     def __init__(self, name: str,
                  task: ty.Callable[[], None] = None,
-                 task_delay: Number = None) -> None:
+                 task_delay: Number = None,
+                 stop_event: ty.Optional[threading.Event] = None) -> None:
         """ServiceLoops are used internally in Services so they can perform asynchronous calls towards the
         tasks.
 
@@ -31,23 +60,133 @@ class ServiceLoop:
             name: Name of the task. Used for logging.
             task: The callable that is performed asynchronously.
             task_delay: The delay in seconds between each task execution.
+            stop_event: Event that stops the loop when set. The loop is not scheduled again after it is set.
         """
         self.name = name
         self.task = task
         self.task_delay = task_delay
+        self.stop_event = stop_event if stop_event else threading.Event()
+        self.failed = False
+
+    @property
+    def alive(self) -> bool:
+        """True as long as the loop is neither stopped nor failed."""
+        return not (self.failed or self.stop_event.is_set())
 
     def __call__(self) -> None:
-        """Target callback called by the Thread."""
-        t = threading.currentThread()
-        # Loop when continue_loop==True.
-        # In the first pass, continue loop might not have been set yet, so we assume True.
-        logging.info(f'Service {self.name} started.')
-        while getattr(t, "continue_loop", True):
+        """Perform the task once, in a worker thread renamed after the service so that the logs show the service."""
+        thread = threading.current_thread()
+        worker_name, thread.name = thread.name, self.name
+        try:
             if self.task:
                 self.task()
-            time.sleep(self.task_delay)
+        finally:
+            thread.name = worker_name
+
+
+class ServiceScheduler:
+    """Performs the ServiceLoops of many services on a small pool of worker threads, instead of one mostly sleeping
+    thread per service."""
 
-        logging.info(f'Service {self.name} stopped.')
+    def __init__(self, max_workers: ty.Optional[int] = None) -> None:
+        """A single timer thread submits every ServiceLoop to the worker pool when it is due, and a loop is scheduled
+        again task_delay seconds after it completes, so the same task never runs twice at the same time.
+
+        Args:
+            max_workers: The number of worker threads. Defaults to one worker per scheduled service, as the tasks are
+                mostly waiting for network and disk, and a worker pr cpu would let slow tasks delay the others.
+        """
+        self.max_workers = max_workers
+        self._executor: ty.Optional[ThreadPoolExecutor] = None
+        self._executor_workers = 0
+        self._retired_executors: ty.List[ThreadPoolExecutor] = []  # Replaced pools that may still complete work.
+        self._loops: ty.Set[ServiceLoop] = set()  # The loops that are scheduled or running.
+        self._queue: ty.List[ty.Tuple[float, int, ServiceLoop]] = []  # Heap of (due time, sequence, loop).
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._timer: ty.Optional[threading.Thread] = None
+
+    def schedule(self, loop: ServiceLoop, delay: Number = 0) -> None:
+        """Perform loop once in delay seconds, and then every task_delay seconds until it is stopped."""
+        with self._condition:
+            self._loops.add(loop)
+        if delay <= 0:
+            self._submit(loop)
+            return
+        with self._condition:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._sequence), loop))
+            if not self._timer:
+                self._timer = threading.Thread(name='service_scheduler', target=self._run, daemon=True)
+                self._timer.start()
+            self._condition.notify()
+
+    def wake(self) -> None:
+        """Let the timer thread drop loops that have been stopped."""
+        with self._condition:
+            self._condition.notify()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut the worker pool down, and if wait, block until the tasks in progress are completed. A new pool is
+        created if loops are scheduled later."""
+        with self._condition:
+            executors = self._retired_executors + ([self._executor] if self._executor else [])
+            self._retired_executors = []
+            self._executor = None
+            self._executor_workers = 0
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+    def _run(self) -> None:
+        """Target of the timer thread. Submits due loops to the worker pool, and exits when nothing is scheduled."""
+        while True:
+            with self._condition:
+                while True:
+                    if not self._queue:
+                        self._timer = None
+                        return
+                    due, _, loop = self._queue[0]
+                    if not loop.alive:
+                        heapq.heappop(self._queue)
+                        self._loops.discard(loop)
+                        logging.info(f'Service {loop.name} stopped.')
+                        continue
+                    wait_time = due - time.monotonic()
+                    if wait_time <= 0:
+                        heapq.heappop(self._queue)
+                        break
+                    self._condition.wait(wait_time)
+            self._submit(loop)
+
+    def _submit(self, loop: ServiceLoop) -> None:
+        """Perform loop in the worker pool now. The pool is replaced by a larger one when more loops are scheduled
+        than it has workers. Work already given to the old pool is still completed."""
+        with self._condition:
+            workers = self.max_workers or max(len(self._loops), 1)
+            if not self._executor or self._executor_workers < workers:
+                if self._executor:
+                    self._executor.shutdown(wait=False)
+                    self._retired_executors.append(self._executor)
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+                self._executor_workers = workers
+            executor = self._executor
+        executor.submit(loop).add_done_callback(functools.partial(self._done, loop))
+
+    def _done(self, loop: ServiceLoop, future: Future) -> None:
+        """Schedule the loop again after a completed task, or mark it failed if the task raised an exception."""
+        error = future.exception()
+        if not error and loop.alive:
+            self.schedule(loop, delay=loop.task_delay)
+            return
+        with self._condition:
+            self._loops.discard(loop)
+        if error:
+            loop.failed = True
+            logging.error(f'Service {loop.name} failed with exception: {error}')
+        else:
+            logging.info(f'Service {loop.name} stopped.')
+
+
+SCHEDULER = ServiceScheduler()
 
 
 class Service:
@@ -66,11 +205,11 @@ class Service:
         Notes:
             The Service does not need a task. It can be a container for a health_check and a restart_action for
         another service that needs monitoring.
-            If the Service is not provided with a task, it does not fire up a Thread and a ServiceLoop. healthy() only
+            If the Service is not provided with a task, it does not schedule a ServiceLoop. healthy() only
         checks the
 
         Args:
-            name: Name of the service used as the thread name.
+            name: Name of the service, used as the thread name while the task is performed.
             task: Callable (method) that we want to perform regularly.
             task_interval: Number of seconds between each task execution.
             health_check_action: Callable (method) that verifies health of task/service. True for healthy, False for
@@ -87,12 +226,13 @@ class Service:
         self.health_check_action = health_check_action if health_check_action else lambda: True
         self.restart_action = restart_action
 
-        self.thread: threading.Thread = None
+        self.loop: ServiceLoop = None
+        self.scheduler = SCHEDULER
 
     def healthy(self) -> bool:
-        """Verify that health_check_action returns True and if we have a task check that the thread is alive."""
+        """Verify that health_check_action returns True and if we have a task check that the loop is alive."""
         if self.task:
-            service_health = self.thread.is_alive() if self.thread else False
+            service_health = self.loop.alive if self.loop else False
         else:
             service_health = True
         return self.health_check_action() and service_health
@@ -100,19 +240,17 @@ class Service:
     def start(self) -> None:
         """Method that starts the service."""
         if self.task:
-            self.thread = threading.Thread(name=self.name,
-                                           target=ServiceLoop(name=self.name,
-                                                              task=self.task,
-                                                              task_delay=self.task_interval))
-            self.thread.continue_loop = True
-            self.thread.start()
+            self.loop = ServiceLoop(name=self.name, task=self.task, task_delay=self.task_interval)
+            self.scheduler.schedule(self.loop)
+            logging.info(f'Service {self.name} started.')
 
     def stop(self) -> None:
         """Method that stops the service."""
         if self.task:
             logging.info(f'Stopping service {self.name}')
-            if isinstance(self.thread, threading.Thread):
-                self.thread.continue_loop = False
+            if self.loop:
+                self.loop.stop_event.set()
+                self.scheduler.wake()
 
     def restart(self) -> None:
         """Perform a restart operation on Service. Usually when self.healthy() == False."""
@@ -155,7 +293,10 @@ class MaintainerService(Service):
         self.health_check_action = health_check_action if health_check_action else lambda: True
         self.restart_action = restart_action
 
-        self.thread: threading.Thread = None
+        self.loop: ServiceLoop = None
+        # The maintainer has a worker of its own, so health checks and restarts are never queued behind tasks in the
+        # shared pool:
+        self.scheduler = ServiceScheduler(max_workers=1)
         self.service_manager = service_manager
 
     @property
@@ -176,6 +317,7 @@ class ServiceManager:
             health_check_interval: Number of seconds between each health check. Defaults to 60 seconds.
         """
         self.services = services if services else list()
+        self.stop_callbacks: ty.List[ty.Callable[[], ty.Any]] = []
         self.maintainer = MaintainerService(
             service_manager=self,
             task=self.check_service_health_and_restart,
@@ -187,6 +329,17 @@ class ServiceManager:
         self.services.append(service)
         logging.info(f'Service {service.name} added to {self.maintainer.name}')
 
+    def add_services(self, services: ty.Iterable[Service]) -> None:
+        """Add several services to managed services."""
+        services = list(services)
+        self.services.extend(services)
+        logging.info(f'Services {", ".join(service.name for service in services)} added to {self.maintainer.name}')
+
+    def add_stop_callback(self, callback: ty.Callable[[], ty.Any]) -> None:
+        """Add a callable that releases resources shared by the services. It is called after the services are stopped,
+        and the tasks they had in progress are completed."""
+        self.stop_callbacks.append(callback)
+
     def check_service_health_and_restart(self) -> None:
         """Check the health of all services and restart if necessary."""
         for service in self.services:
@@ -205,6 +358,12 @@ class ServiceManager:
         self.maintainer.stop()
         for service in self.services:
             service.stop()
+        if self.stop_callbacks:
+            # Tasks in progress may still use the shared resources, so they are completed first:
+            for scheduler in {service.scheduler for service in self.services}:
+                scheduler.shutdown(wait=True)
+        for callback in self.stop_callbacks:
+            callback()
 
     def restart_services(self) -> None:
         """Restart all services."""
@@ -0,0 +1,73 @@
+import pytest
+
+from weather.utilities.adaptive_token_bucket import AdaptiveTokenBucket, AdaptiveTokenBucketError
+
+
+class FakeClock:
+    """A clock that only moves when someone sleeps."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def create_bucket(clock, **kwargs):
+    return AdaptiveTokenBucket(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_burst_within_capacity():
+    clock = FakeClock()
+    bucket = create_bucket(clock, capacity=3, max_rate=1)
+    for _ in range(3):
+        bucket.acquire()
+    assert not clock.sleeps  # A full bucket allows a burst without waiting.
+
+
+def test_wait_when_empty():
+    clock = FakeClock()
+    bucket = create_bucket(clock, capacity=3, max_rate=2)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == pytest.approx(0.5)  # One token at two tokens pr second.
+
+
+def test_throttle_and_recover():
+    clock = FakeClock()
+    bucket = create_bucket(clock, capacity=3, max_rate=2, beta=0.5)
+    bucket.on_throttle()
+    assert bucket.rate == 1
+    assert bucket.tokens == 0
+
+    bucket.acquire()
+    assert clock.now == pytest.approx(1)  # Empty bucket refilling at the reduced rate.
+
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == bucket.max_rate  # Never grows past max_rate.
+
+
+def test_throttle_never_below_min_rate():
+    clock = FakeClock()
+    bucket = create_bucket(clock, capacity=1, max_rate=1, min_rate=0.25)
+    for _ in range(10):
+        bucket.on_throttle()
+    assert bucket.rate == 0.25
+
+
+def test_from_rate_limits_stays_within_limits():
+    limits = {'short': dict(action_limit=50, timespan=10, wait_time=1),
+              'long': dict(action_limit=500, timespan=3600, wait_time=10)}
+    bucket = AdaptiveTokenBucket.from_rate_limits(limits.values())
+    for limit in limits.values():
+        assert bucket.capacity + bucket.max_rate * limit['timespan'] <= limit['action_limit']
+
+
+def test_from_rate_limits_empty():
+    with pytest.raises(AdaptiveTokenBucketError):
+        AdaptiveTokenBucket.from_rate_limits([])
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from weather.utilities.aimd_concurrency_limiter import AimdConcurrencyLimiter, AimdConcurrencyLimiterError
+
+
+def test_additive_increase_up_to_max():
+    limiter = AimdConcurrencyLimiter(initial_limit=1, max_limit=3, latency_target=1)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.limit == 3
+
+
+def test_slow_calls_do_not_increase():
+    limiter = AimdConcurrencyLimiter(initial_limit=1, max_limit=3, latency_target=1)
+    limiter.acquire()
+    limiter.release(latency=5)
+    assert limiter.limit == 1
+
+
+def test_multiplicative_decrease_on_throttle():
+    limiter = AimdConcurrencyLimiter(initial_limit=4, max_limit=4, min_limit=1)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+
+
+def test_acquire_waits_for_release():
+    limiter = AimdConcurrencyLimiter(initial_limit=1, max_limit=1)
+    limiter.acquire()
+
+    acquired = threading.Event()
+
+    def second_call():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second_call)
+    thread.start()
+    assert not acquired.wait(0.05)  # The limit is reached, so the second call waits.
+    limiter.release(latency=0.1)
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_invalid_limits():
+    with pytest.raises(AimdConcurrencyLimiterError):
+        AimdConcurrencyLimiter(initial_limit=5, max_limit=2)
@@ -0,0 +1,160 @@
+"""Tests for the BatchingDtsClient."""
+import threading
+import time
+
+import pytest
+import shyft.time_series as st
+
+from weather.service import batching_dts_client
+from weather.service.batching_dts_client import BatchingDtsClient, get_shared_client, close_shared_clients
+
+
+class EchoClient:
+    """A DtsClient stand-in that returns the timeseries it is asked to evaluate. Requests containing a timeseries named
+    bad://* fail."""
+    requests = []
+    closed = []
+
+    def __init__(self, address):
+        self.address = address
+
+    def evaluate(self, tsv, period):
+        EchoClient.requests.append(len(tsv))
+        self.check(tsv)
+        return tsv
+
+    def store_ts(self, tsv, overwrite_on_write):
+        EchoClient.requests.append(len(tsv))
+        self.check(tsv)
+
+    def close(self):
+        EchoClient.closed.append(self.address)
+
+    @staticmethod
+    def check(tsv):
+        if any(ts.ts_id().startswith('bad://') for ts in tsv):
+            raise RuntimeError('Bad timeseries.')
+
+
+def run_together(client, target, calls):
+    """Run target(call) for every call in separate threads. The underlying client is held until every call has joined
+    a batch, so the calls are sent together."""
+    threads = [threading.Thread(target=target, args=(call,)) for call in calls]
+    with client._client_lock:
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while client._callers < len(calls) and time.time() < deadline:
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_calls_for_same_period_share_one_request():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    period = st.UtcPeriod(0, 3600)
+    calls = {'a': [st.TimeSeries('a://1'), st.TimeSeries('a://2')], 'b': [st.TimeSeries('b://1')]}
+    results = {}
+
+    def evaluate(name):
+        results[name] = [ts.ts_id() for ts in client.batch_evaluate(calls[name], period)]
+
+    run_together(client, evaluate, calls)
+
+    assert EchoClient.requests == [3]
+    assert results == {'a': ['a://1', 'a://2'], 'b': ['b://1']}
+
+
+def test_nearly_equal_periods_share_one_request():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, period_resolution=60, client_factory=EchoClient)
+    periods = [st.UtcPeriod(1, 3601), st.UtcPeriod(2, 3602)]
+
+    run_together(client, lambda period: client.batch_evaluate([st.TimeSeries('a://1')], period), periods)
+
+    assert EchoClient.requests == [2]
+    assert client.round_period(periods[0]) == st.UtcPeriod(0, 3660)
+
+
+def test_evaluated_period_is_the_requested_period():
+    class EvaluatingClient(EchoClient):
+        def evaluate(self, tsv, period):
+            return st.TsVector([st.TimeSeries(st.TimeAxis(period.start, period.timespan(), 1), 0.0,
+                                              st.POINT_AVERAGE_VALUE) for _ in tsv])
+
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EvaluatingClient)
+    period = st.UtcPeriod(1, 3601)
+    result = client.batch_evaluate([st.TimeSeries('a://1')], period)
+    assert result[0].time_axis.total_period() == period
+
+
+def test_calls_for_different_periods_are_not_batched():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    client.batch_evaluate([st.TimeSeries('a://1')], st.UtcPeriod(0, 3600))
+    client.batch_evaluate([st.TimeSeries('a://1')], st.UtcPeriod(0, 7200))
+    assert EchoClient.requests == [1, 1]
+
+
+def test_failed_evaluate_only_fails_the_caller_it_belongs_to():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    period = st.UtcPeriod(0, 3600)
+    outcome = {}
+
+    def evaluate(ts_id):
+        try:
+            outcome[ts_id] = client.batch_evaluate([st.TimeSeries(ts_id)], period)[0].ts_id()
+        except RuntimeError:
+            outcome[ts_id] = 'failed'
+
+    run_together(client, evaluate, ['a://1', 'bad://1'])
+
+    assert outcome == {'a://1': 'a://1', 'bad://1': 'failed'}
+    assert sorted(EchoClient.requests) == [1, 1, 2]  # The batch, then each caller on its own.
+
+
+def test_single_caller_error_is_raised():
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    with pytest.raises(RuntimeError):
+        client.batch_evaluate([st.TimeSeries('bad://1')], st.UtcPeriod(0, 3600))
+
+
+def test_concurrent_stores_share_one_request():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    stores = [[st.TimeSeries('a://1')], [st.TimeSeries('b://1'), st.TimeSeries('b://2')]]
+    run_together(client, client.batch_store_ts, stores)
+    assert EchoClient.requests == [3]
+
+
+def test_failed_store_only_fails_the_caller_it_belongs_to():
+    EchoClient.requests = []
+    client = BatchingDtsClient('localhost:1', max_delay=0, client_factory=EchoClient)
+    failed = []
+
+    def store(ts_id):
+        try:
+            client.batch_store_ts([st.TimeSeries(ts_id)])
+        except RuntimeError:
+            failed.append(ts_id)
+
+    run_together(client, store, ['a://1', 'bad://1'])
+
+    assert failed == ['bad://1']
+    assert sorted(EchoClient.requests) == [1, 1, 2]
+
+
+def test_close_shared_clients(monkeypatch):
+    EchoClient.closed = []
+    monkeypatch.setattr(batching_dts_client, 'BatchingDtsClient',
+                        lambda address: BatchingDtsClient(address, client_factory=EchoClient))
+    client = get_shared_client('localhost:2')
+    assert get_shared_client('localhost:2') is client
+
+    close_shared_clients()
+
+    assert EchoClient.closed == ['localhost:2']
+    assert get_shared_client('localhost:2') is not client
+    close_shared_clients()
@@ -34,4 +34,25 @@ def test_data_class_repr():
     args = dict(name='something', value=2)
     d = DataClass(**args)
 
-    assert repr(d) == "DataClass(name='something', value=2)"
\ No newline at end of file
+    assert repr(d) == "DataClass(name='something', value=2)"
+
+
+def test_data_class_dir_follows_dict():
+    d = DataClass(Name='something')
+    d.dict['Value'] = 2
+
+    assert d.dir == ['name', 'value']
+
+
+def test_data_class_extra_dir():
+    class Extended(DataClass):
+        _extra_dir = ('extra',)
+
+        @property
+        def extra(self):
+            return 'something extra'
+
+    d = Extended(name='something')
+
+    assert 'extra' in dir(d)
+    assert d.dir == ['extra', 'name']
@@ -63,6 +63,12 @@ def test_data_collection_period_absolute():
     assert collection.period() == st.UtcPeriod(cal.time(2019, 1, 1), cal.time(2019, 2, 1))
 
 
+def test_data_collection_period_absolute_default_end():
+    before = st.utctime_now()
+    collection = DataCollectionPeriodAbsolute(start=0, wait_time=10)
+    assert collection.period().end >= before  # Now at construction, not at import.
+
+
 def test_read_and_store(dtss):
     dtss.start()
     client = DtsClient(dtss.address)
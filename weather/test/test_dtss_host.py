@@ -61,12 +61,41 @@ def test_read_callback_success(dtss):
         assert ts.values.to_numpy()[0] == value
 
 
+def test_heartbeat_read(dtss):
+    ts_ids = [create_heartbeat_request('first'), create_heartbeat_request('second')]
+    result = dtss.repos['heartbeat'].read(list_of_ts_id=ts_ids, period=UtcPeriod(time(0), time(5)))
+    assert list(result) == ts_ids
+    assert all(ts.values.to_numpy()[0] == 1 for ts in result.values())
+
+
 def test_find_callback_success(dtss):
     query = 'mock1://something/1'
     tsiv = dtss.find_callback(query=query)
     assert tsiv[0].name == query
 
 
+def test_find_callback_cache():
+    class CachedMockRepository(MockRepository1):
+        find_cache_ttl = 60
+        finds = 0
+
+        def find_callback(self, query):
+            CachedMockRepository.finds += 1
+            return super().find_callback(query)
+
+    host = DtssHost(port_num=find_free_port(),
+                    container_directory=tempfile.mkdtemp(prefix='dtss_store_'),
+                    data_collection_repositories=[(CachedMockRepository, dict())])
+    query = 'mock1://something/1'
+    for _ in range(3):
+        assert host.find_callback(query=query)[0].name == query
+    assert CachedMockRepository.finds == 1
+
+    host.initiate_repos()  # New repositories start without cached results.
+    host.find_callback(query=query)
+    assert CachedMockRepository.finds == 2
+
+
 def test_dts_client(dtss):
     dtss.start()
     timeseries = ['mock1://something/1', 'mock2://something_else/2', 'mock1://something_strange/3']
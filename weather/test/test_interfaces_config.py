@@ -283,4 +283,14 @@ def test_encrypted_environment_config():
 
     del os.environ['arg1_var']
     del os.environ['arg2_var']
-    del os.environ['arg3_var']
\ No newline at end of file
+    del os.environ['arg3_var']
+
+
+def test_require_env_var():
+    os.environ['arg1_var'] = 'something'
+    try:
+        assert EnvVarConfig.require_env_var('arg1_var') == 'something'
+        with pytest.raises(EnvironmentError):
+            EnvVarConfig.require_env_var('arg9_var')
+    finally:
+        del os.environ['arg1_var']
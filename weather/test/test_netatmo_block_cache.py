@@ -0,0 +1,31 @@
+from weather.data_sources.netatmo.block_cache import NetatmoBlockCache, BLOCK_SIZE, SETTLE_TIME
+
+
+def test_block_cache_roundtrip(tmp_path):
+    cache = NetatmoBlockCache(str(tmp_path / 'blocks.sqlite'))
+    key = cache.create_key(device_id='device', module_id=None, mtype='Temperature,Humidity', date_start=100.0)
+    body = {'100': [21.5, None], '400': [21.7, 40]}
+
+    assert cache.get(key) is None
+    cache.put(key, body)
+    assert cache.get(key) == body
+    cache.close()
+
+
+def test_block_cache_only_full_and_settled_blocks_are_final():
+    full = {str(t): [1.0] for t in range(BLOCK_SIZE)}
+    now = BLOCK_SIZE + SETTLE_TIME + 1
+
+    assert NetatmoBlockCache.is_final(body=full, last_time=BLOCK_SIZE - 1, now=now)
+    assert not NetatmoBlockCache.is_final(body=full, last_time=now - 1, now=now)  # Too recent.
+    assert not NetatmoBlockCache.is_final(body={'0': [1.0]}, last_time=0, now=now)  # Not a full block.
+
+
+def test_block_cache_trims_to_date_end(tmp_path):
+    cache = NetatmoBlockCache(str(tmp_path / 'blocks.sqlite'))
+    key = cache.create_key(device_id='device', module_id='module', mtype='Temperature', date_start=100.0)
+    cache.put(key, {'100': [21.5], '400': [21.7], '700': [21.9]})
+
+    assert cache.get(key, date_end=400) == {'100': [21.5], '400': [21.7]}
+    assert cache.get(key, date_end=None) == {'100': [21.5], '400': [21.7], '700': [21.9]}
+    cache.close()
@@ -5,7 +5,8 @@ Assumes that pytest is run with the following arguments:
 """
 import pytest
 
-from weather.data_sources.netatmo.domain import NetatmoDomain, NetatmoStation
+from weather.data_sources.netatmo import domain as domain_module
+from weather.data_sources.netatmo.domain import NetatmoDomain, NetatmoStation, NetatmoDomainError
 from weather.data_sources.netatmo.repository import NetatmoEncryptedEnvVarConfig
 from weather.test.bin.netatmo_test_data import MOCK_STATION_CONFIG
 
@@ -67,6 +68,13 @@ def test_domain_login_mock():
     assert meas.station.id == 'bogus:station:id:1'
 
 
+def test_domain_get_measurement_unknown_data_type():
+    domain = NetatmoDomain(device_metadata=MOCK_STATION_CONFIG)
+
+    with pytest.raises(NetatmoDomainError):
+        domain.get_measurement(station_name='Superstation', module_name='Basement', data_type='Earthquake')
+
+
 def test_domain_login(config):
     if config is None:
         pytest.skip(f'Netatmo is not properly configured.')
@@ -76,3 +84,43 @@ def test_domain_login(config):
         client_id=config.client_id,
         client_secret=config.client_secret)
     assert domain
+
+
+LOGIN = dict(username='user', password='pass', client_id='id', client_secret='secret')
+
+
+def test_domain_metadata_cache_fallback(tmp_path, monkeypatch):
+    path = domain_module.metadata_cache_path(cache_directory=str(tmp_path), client_id=LOGIN['client_id'])
+    domain_module._write_metadata_cache(path, MOCK_STATION_CONFIG)
+
+    def offline(**kwargs):
+        raise ConnectionError('No network.')
+
+    monkeypatch.setattr(domain_module, '_fetch_station_metadata', offline)
+    domain = NetatmoDomain(**LOGIN, cache_directory=str(tmp_path), cache_ttl=0)  # Stale cache, but api is down.
+
+    assert domain.stations[0].name == 'Superstation'
+
+
+def test_domain_metadata_cache_miss_offline(tmp_path, monkeypatch):
+    def offline(**kwargs):
+        raise ConnectionError('No network.')
+
+    monkeypatch.setattr(domain_module, '_fetch_station_metadata', offline)
+    with pytest.raises(NetatmoDomainError):
+        NetatmoDomain(**LOGIN, cache_directory=str(tmp_path))
+
+
+def test_domain_metadata_cache_fresh_does_not_fetch(tmp_path):
+    path = domain_module.metadata_cache_path(cache_directory=str(tmp_path), client_id=LOGIN['client_id'])
+    domain_module._write_metadata_cache(path, MOCK_STATION_CONFIG)
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return MOCK_STATION_CONFIG
+
+    metadata = domain_module.get_cached_station_metadata(fetch=fetch, cache_path=path, cache_ttl=3600)
+
+    assert metadata == MOCK_STATION_CONFIG
+    assert not fetches
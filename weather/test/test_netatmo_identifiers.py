@@ -1,7 +1,9 @@
 """Test the netatmo identifiers."""
 
 from weather.data_sources.netatmo.identifiers import (create_ts_id, create_ts_query, parse_ts_query, parse_ts_id,
-                                                      NetatmoUrlParseError)
+                                                      create_ts_netatmo, create_ts_netatmo_batch, NetatmoUrlParseError)
+from weather.data_sources.netatmo.domain import NetatmoStation
+from weather.test.bin.netatmo_test_data import MOCK_STATION_CONFIG
 
 
 def test_create_ts_id():
@@ -20,6 +22,13 @@ def test_parse_ts_query():
     assert kwargs == result
 
 
+def test_parse_ts_id_special_characters():
+    kwargs = {'station_name': 'Cabin+Garage 100%',
+              'module_name': 'Sauna & Bath=hot',
+              'data_type': 'Temperature'}
+    assert parse_ts_id(ts_id=create_ts_id(**kwargs)) == kwargs
+
+
 def test_parse_ts_query_wrong_repo():
     """Should fail when scheme does not match repo name."""
     ts_query = 'bogus://?station_name=this_station&device_name=Someplace&module_name=Somewhere&data_type=Earthquake'
@@ -34,3 +43,11 @@ def test_create_ts_query():
     expected = 'netatmo://?station_name=this_station&module_name=Somewhere&data_type=Earthquake'
     result = create_ts_query(station_name='this_station', module_name='Somewhere', data_type='Earthquake')
     assert result == expected
+
+
+def test_create_ts_netatmo_batch():
+    station = NetatmoStation(**MOCK_STATION_CONFIG['station:mock:id:1'])
+    measurements = [measurement for module in station.modules for measurement in module.measurements]
+    expected = [create_ts_netatmo(measurement).ts_id() for measurement in measurements]
+    result = [ts.ts_id() for ts in create_ts_netatmo_batch(measurements)]
+    assert result == expected
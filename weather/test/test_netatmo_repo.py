@@ -1,8 +1,10 @@
 from shyft.time_series import Calendar, UtcPeriod, StringVector
 import pytest
 import logging
+import threading
+import time
 
-from weather.data_sources.netatmo.repository import NetatmoRepository, NetatmoEncryptedEnvVarConfig
+from weather.data_sources.netatmo.repository import NetatmoRepository, NetatmoEncryptedEnvVarConfig, NetatmoApiError
 from weather.data_sources.netatmo.domain import types, NetatmoDomain
 from weather.data_sources.netatmo.identifiers import create_ts_id, create_ts_query
 from weather.test.bin.netatmo_test_data import MOCK_STATION_CONFIG
@@ -140,3 +142,86 @@ def test_find_callback_module(net):
     tsiv = net.find_callback(query=ts_query)
 
     assert tsiv
+
+
+def test_server_wait_time_from_headers():
+    net = NetatmoRepository(username='user', password='pass', client_id='id', client_secret='secret',
+                            block_cache_path=None)
+    now = 1600000000.0
+    assert net.server_wait_time(now) == 0
+
+    net._observe_rate_limit_headers({'X-RateLimit-Remaining': '400', 'X-RateLimit-Limit': '500',
+                                     'X-RateLimit-Reset': str(now + 100)})
+    assert net.server_wait_time(now) == 0  # Plenty of quota left.
+
+    net._observe_rate_limit_headers({'X-RateLimit-Remaining': '10', 'X-RateLimit-Limit': '500',
+                                     'X-RateLimit-Reset': str(now + 100)})
+    assert net.server_wait_time(now) == pytest.approx(10)  # Spread the remaining calls until the reset.
+
+    net._observe_rate_limit_headers({'Retry-After': '30'})
+    assert net.server_wait_time(now) > 0
+
+
+def fetch_block_with_status_codes(monkeypatch, status_codes):
+    """Call _fetch_block_body with get_measure answering with the given http status codes, and then with data."""
+    net = NetatmoRepository(username='user', password='pass', client_id='id', client_secret='secret',
+                            block_cache_path=None)
+    calls = []
+    logins = []
+
+    def get_measure(**kwargs):
+        calls.append(kwargs['device_data'])
+        if len(calls) <= len(status_codes):
+            raise NetatmoApiError('Netatmo getmeasure failed.', status_code=status_codes[len(calls) - 1])
+        return {'body': {'0': [1.0]}}
+
+    monkeypatch.setattr(net, 'get_measure', get_measure)
+    monkeypatch.setattr(net, 'ensure_login', lambda rejected=None: logins.append(rejected) or ('new login', None))
+    body = net._fetch_block_body(device_data='old login', device_id='device', module_id='module', mtype='Temperature',
+                                 date_start=0, date_end=300)
+    return net, body, calls, logins
+
+
+def test_fetch_block_fails_fast_on_client_error(monkeypatch):
+    with pytest.raises(NetatmoApiError):
+        fetch_block_with_status_codes(monkeypatch, [400])
+
+
+def test_fetch_block_logs_in_again_on_rejected_token(monkeypatch):
+    net, body, calls, logins = fetch_block_with_status_codes(monkeypatch, [403])
+    assert body == {'0': [1.0]}
+    assert calls == ['old login', 'new login']
+    assert logins == ['old login']
+
+
+def test_fetch_block_retries_when_throttled(monkeypatch):
+    net, body, calls, logins = fetch_block_with_status_codes(monkeypatch, [429, 503])
+    assert body == {'0': [1.0]}
+    assert len(calls) == 3
+    assert not logins
+
+
+def test_ensure_login_once_for_concurrent_calls(monkeypatch):
+    net = NetatmoRepository(username='user', password='pass', client_id='id', client_secret='secret',
+                            block_cache_path=None)
+    logins = []
+
+    class Auth:
+        expiration = float('inf')
+
+    def create_netatmo_connection():
+        logins.append(1)
+        time.sleep(0.05)  # Let the other threads reach the login.
+        net.auth = Auth()
+        return f'device data {len(logins)}', f'domain {len(logins)}'
+
+    monkeypatch.setattr(net, 'create_netatmo_connection', create_netatmo_connection)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(net.ensure_login())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(logins) == 1
+    assert results == [('device data 1', 'domain 1')] * 4
@@ -1,8 +1,11 @@
 """Test components related to the ServiceManager."""
 import time
+import signal
 import logging
+import threading
 
-from weather.service.service_manager import ServiceManager, Service
+from weather.service import service_manager
+from weather.service.service_manager import ServiceManager, Service, ServiceScheduler, wait_for_stop_signal
 
 logging.basicConfig(
     level=logging.INFO,
@@ -68,4 +71,106 @@ def test_service_boss():
         time.sleep(0.1)
         assert task2.state == 1  # State has been automatically set to 1 via health_check and restart.
     finally:
-        sm.stop_services()
\ No newline at end of file
+        sm.stop_services()
+
+
+def test_wait_for_stop_signal():
+    previous_handlers = {number: signal.getsignal(number) for number in (signal.SIGINT, signal.SIGTERM)}
+    stop_event = threading.Event()
+    threading.Timer(0.05, stop_event.set).start()
+    try:
+        wait_for_stop_signal(stop_event)
+        assert stop_event.is_set()
+        assert {number: signal.getsignal(number) for number in previous_handlers} == previous_handlers
+    finally:
+        for number, handler in previous_handlers.items():
+            signal.signal(number, handler)
+
+
+def test_add_services():
+    services = ServiceManager()
+    services.add_services(Service(name=name) for name in ['first', 'second'])
+    assert [service.name for service in services.services] == ['first', 'second']
+    assert services.maintainer.name == 'maintainer[first, second]'
+
+
+def test_stop_wakes_sleeping_service():
+    task = DummyTask('sleepy')
+    service = Service(name=task.name, task=task.perform, task_interval=3600)
+    service.start()
+    service.stop()
+    assert not service.healthy()  # Stopped without waiting for the task interval.
+
+
+def test_failing_task_makes_service_unhealthy():
+    def fail():
+        raise ValueError('Task failed.')
+
+    service = Service(name='failing', task=fail, task_interval=0.01)
+    service.start()
+    try:
+        time.sleep(0.1)
+        assert not service.healthy()
+    finally:
+        service.stop()
+
+
+def test_stop_callbacks_run_on_stop():
+    stopped = []
+    services = ServiceManager(services=[Service(name='first', task=lambda: None, task_interval=3600)])
+    services.add_stop_callback(lambda: stopped.append(True))
+    services.start_services()
+    services.stop_services()
+    assert stopped == [True]
+
+
+def test_stop_callbacks_wait_for_tasks_in_progress():
+    events = []
+    running = threading.Event()
+
+    def task():
+        running.set()
+        time.sleep(0.1)
+        events.append('task done')
+
+    service = Service(name='slow', task=task, task_interval=3600)
+    service.scheduler = ServiceScheduler()
+    services = ServiceManager(services=[service])
+    services.add_stop_callback(lambda: events.append('stopped'))
+    services.start_services()
+    assert running.wait(1)
+    services.stop_services()
+    assert events == ['task done', 'stopped']
+
+
+def test_maintainer_runs_while_service_pool_is_busy(monkeypatch):
+    monkeypatch.setattr(service_manager, 'SCHEDULER', ServiceScheduler(max_workers=1))
+    release = threading.Event()
+    checked = threading.Event()
+    busy = Service(name='busy', task=release.wait, task_interval=3600,
+                   health_check_action=lambda: checked.set() or True)
+    services = ServiceManager(services=[busy], health_check_interval=0.01)
+    services.start_services()
+    try:
+        assert checked.wait(1)  # The only shared worker is busy, but the health check still runs.
+    finally:
+        release.set()
+        services.stop_services()
+
+
+def test_scheduler_has_a_worker_per_service():
+    scheduler = ServiceScheduler()
+    release = threading.Event()
+    started = []
+    services = [Service(name=name, task=lambda name=name: started.append(name) or release.wait(1), task_interval=3600)
+                for name in ['first', 'second', 'third']]
+    for service in services:
+        service.scheduler = scheduler
+        service.start()
+    try:
+        time.sleep(0.1)
+        assert sorted(started) == ['first', 'second', 'third']  # No task waits for another to finish.
+    finally:
+        release.set()
+        for service in services:
+            service.stop()
@@ -113,8 +113,9 @@ class MockRepository1(DataCollectionRepository):
             A TsVector containing the resulting timeseries containing data enough to cover the query period.
         """
 
-        return {ts_id: ts for ts_id , ts in zip(list_of_ts_id, self.read_callback(ts_ids=StringVector([list_of_ts_id]),
-                                                                                  read_period=period))}
+        ts_ids = list_of_ts_id if isinstance(list_of_ts_id, StringVector) else StringVector(list_of_ts_id)
+
+        return {ts_id: ts for ts_id, ts in zip(ts_ids, self.read_callback(ts_ids=ts_ids, read_period=period))}
 
     def read_forecast(self, list_of_fc_id: List[str], period: UtcPeriod):
         """
@@ -0,0 +1,109 @@
+"""An adaptive token bucket for pacing calls to rate limited apis."""
+import logging
+import threading
+import time
+from typing import Union, Iterable, Mapping, Callable
+
+Number = Union[int, float]
+
+
+class AdaptiveTokenBucketError(Exception):
+    """Errors raised by the AdaptiveTokenBucket."""
+    pass
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, *,
+                 capacity: Number,
+                 max_rate: Number,
+                 min_rate: Number = None,
+                 increment: Number = None,
+                 alpha: Number = 1.1,
+                 beta: Number = 0.5,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """A token bucket that holds up to capacity tokens and refills at a rate that adapts to how the api responds.
+        Every call takes a token, and waits for one if the bucket is empty. Successful calls increase the rate towards
+        max_rate, and throttled calls cut the rate and empty the bucket (additive/multiplicative increase,
+        multiplicative decrease).
+
+        Args:
+            capacity: The maximum number of tokens, i.e. the largest burst of calls allowed.
+            max_rate: The highest refill rate, in tokens pr second. This is also the initial rate.
+            min_rate: The lowest refill rate, in tokens pr second. Defaults to 1% of max_rate.
+            increment: The smallest increase of the rate after a successful call. Defaults to 5% of max_rate.
+            alpha: Multiplicative increase of the rate after a successful call.
+            beta: Multiplicative decrease of the rate after a throttled call.
+            clock: Monotonic clock returning seconds.
+            sleep: Function used to wait for tokens.
+        """
+        if capacity < 1 or max_rate <= 0:
+            raise AdaptiveTokenBucketError(f'{AdaptiveTokenBucket.__name__} needs a capacity of at least one token and '
+                                           f'a positive max_rate: capacity={capacity}, max_rate={max_rate}')
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.min_rate = min_rate if min_rate is not None else max_rate / 100
+        self.increment = increment if increment is not None else max_rate / 20
+        self.alpha = alpha
+        self.beta = beta
+        self._clock = clock
+        self._sleep = sleep
+
+        self.rate = max_rate
+        self.tokens = capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rate_limits(cls, rate_limits: Iterable[Mapping[str, Number]], **kwargs) -> "AdaptiveTokenBucket":
+        """Create a bucket that never exceeds a set of rate limits, given as dicts with an action_limit and a timespan
+        (like the arguments of a RateLimiter). A bucket allows at most capacity + max_rate * timespan calls within any
+        timespan, so half of the smallest action_limit is used for bursts, and max_rate is set so the rest of every
+        limit is never exceeded.
+
+        Args:
+            rate_limits: Dicts with action_limit (number of calls) and timespan (seconds). Other keys are ignored.
+            **kwargs: Other arguments passed on to AdaptiveTokenBucket.
+
+        Returns:
+            An AdaptiveTokenBucket respecting all of the rate limits.
+        """
+        limits = [(limit['action_limit'], limit['timespan']) for limit in rate_limits]
+        if not limits:
+            raise AdaptiveTokenBucketError(f'{AdaptiveTokenBucket.__name__} needs at least one rate limit.')
+        capacity = max(1, min(action_limit for action_limit, _ in limits) // 2)
+        max_rate = min((action_limit - capacity) / float(timespan) for action_limit, timespan in limits)
+        return cls(capacity=capacity, max_rate=max_rate, **kwargs)
+
+    def _refill(self) -> None:
+        """Add the tokens accumulated since the last refill at the current rate."""
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        """Take a token from the bucket, and wait until one is available if the bucket is empty."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            logging.info(f'{AdaptiveTokenBucket.__name__}: asleep for {wait_time:.2f}s. Rate: {self.rate:.3f} actions '
+                         f'pr s')
+            self._sleep(wait_time)
+
+    def on_success(self) -> None:
+        """Register a call that was accepted by the api, and increase the rate towards max_rate."""
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, max(self.rate + self.increment, self.rate * self.alpha))
+
+    def on_throttle(self) -> None:
+        """Register a call that was throttled by the api. Cut the rate and empty the bucket, so the next call waits."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.beta)
+            self.tokens = 0
+        logging.warning(f'{AdaptiveTokenBucket.__name__}: throttled, rate reduced to {self.rate:.3f} actions pr s.')
@@ -0,0 +1,69 @@
+"""A concurrency limiter that adapts the number of calls in flight to how an api responds."""
+import logging
+import threading
+from collections import deque
+from typing import Optional
+
+
+class AimdConcurrencyLimiterError(Exception):
+    """Errors raised by the AimdConcurrencyLimiter."""
+    pass
+
+
+class AimdConcurrencyLimiter:
+    def __init__(self, *,
+                 initial_limit: int = 1,
+                 min_limit: int = 1,
+                 max_limit: int = 4,
+                 latency_target: float = 2.0,
+                 window: int = 10,
+                 beta: float = 0.5) -> None:
+        """Limit the number of concurrent calls to an api, and adapt the limit with additive increase and
+        multiplicative decrease (AIMD): the limit grows by one while the mean latency of recent calls is within
+        latency_target, and is cut by beta when a call fails or is throttled.
+
+        Args:
+            initial_limit: The number of concurrent calls allowed at start.
+            min_limit: The lowest number of concurrent calls allowed.
+            max_limit: The highest number of concurrent calls allowed.
+            latency_target: The mean latency in seconds of recent calls that allows the limit to grow.
+            window: The number of recent calls used for the mean latency.
+            beta: Multiplicative decrease of the limit after a failed call.
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise AimdConcurrencyLimiterError(f'{AimdConcurrencyLimiter.__name__} needs 1 <= min_limit <= '
+                                              f'initial_limit <= max_limit: {min_limit}, {initial_limit}, {max_limit}')
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.beta = beta
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait until there is room for another call within the current limit, and register the call as in flight."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, *, latency: Optional[float] = None, throttled: bool = False) -> None:
+        """Register that a call is done, and adapt the limit to how it went.
+
+        Args:
+            latency: The duration of the call in seconds.
+            throttled: True if the call failed or was throttled by the api.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, int(self.limit * self.beta))
+                self.latencies.clear()
+                logging.info(f'{AimdConcurrencyLimiter.__name__}: concurrency reduced to {self.limit}.')
+            elif latency is not None:
+                self.latencies.append(latency)
+                if sum(self.latencies) / len(self.latencies) <= self.latency_target:
+                    self.limit = min(self.max_limit, self.limit + 1)
+            self._condition.notify_all()
@@ -6,9 +6,15 @@ class DataClass:
     """
     Class for object (struct) representation of dictionaries.
     """
+    _extra_dir: typing.Tuple[str, ...] = ()  # Subclass attributes outside of the dict that dir() should list.
+
     def __init__(self, **kwargs) -> None:
         self.dict = kwargs
-        self.dir = sorted([key.lower() for key in kwargs])
+
+    @property
+    def dir(self) -> typing.List[str]:
+        """The lowercase keys of the object, sorted. Only used for introspection, so it is built on demand."""
+        return sorted([key.lower() for key in self.dict] + list(self._extra_dir))
 
     def __getattr__(self, item: str) -> str:
         return self.dict[item]